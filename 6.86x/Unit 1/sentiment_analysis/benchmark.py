@@ -0,0 +1,212 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import scipy
+import scipy.sparse as sparse
+
+import project1 as p1
+
+# Benchmarks of the featurizers and trainers of project1 on synthetic data.
+#
+#   python benchmark.py --n 5000 --d 2000 --density 0.01 --output new.json
+#   python benchmark.py --output new.json --compare old.json
+#
+# Every benchmark is timed as the best of --repeat runs, then run once more
+# under tracemalloc to measure its peak memory. The results are written as
+# JSON, and --compare prints the speedup of every benchmark over a previous
+# results file.
+
+
+def synthetic_word(i):
+    """
+    Returns the i-th synthetic word, i written in base 26 with the letters
+    a to z. The words are letters only, so extract_words keeps them whole.
+    """
+    letters = []
+    while True:
+        i, digit = divmod(i, 26)
+        letters.append(chr(ord('a') + digit))
+        if i == 0:
+            return 'w' + ''.join(reversed(letters))
+
+
+def synthetic_corpus(n, vocabulary_size, length, seed=0):
+    """
+    Returns a list of n synthetic reviews of about length words each, drawn
+    from vocabulary_size distinct words with Zipf-like frequencies and mixed
+    with capital letters, punctuation and digits like real reviews.
+    """
+    rng = np.random.RandomState(seed)
+    vocabulary = np.array([synthetic_word(i) for i in range(vocabulary_size)], dtype=object)
+    vocabulary[::7] = [word.capitalize() for word in vocabulary[::7]]
+    frequencies = 1 / np.arange(1, vocabulary_size + 1)
+    frequencies /= frequencies.sum()
+    symbols = np.array(['.', ',', '!', '2', '(', ')'], dtype=object)
+    texts = []
+    for _ in range(n):
+        words = vocabulary[rng.choice(vocabulary_size, length, p=frequencies)]
+        marks = rng.rand(length) < 0.1
+        words[marks] = words[marks] + symbols[rng.randint(len(symbols), size=marks.sum())]
+        texts.append(' '.join(words))
+    return texts
+
+
+def synthetic_data(n, d, density, sparse_output=False, seed=0):
+    """
+    Returns (feature_matrix, labels) with n samples of d features, of which
+    about a fraction density is nonzero, labeled by a random linear
+    classifier with some label noise.
+    """
+    rng = np.random.RandomState(seed)
+    feature_matrix = sparse.random(n, d, density=density, format='csr', random_state=rng,
+                                   data_rvs=lambda size: rng.randint(1, 4, size).astype(float))
+    theta = rng.randn(d)
+    labels = np.where(feature_matrix @ theta + 0.1 * rng.randn(n) > 0, 1, -1)
+    if not sparse_output:
+        feature_matrix = feature_matrix.toarray()
+    return feature_matrix, labels
+
+
+def measure(fn, repeat):
+    """
+    Returns the tuple (seconds, peak_bytes) of the best time of repeat calls
+    of fn and the peak memory traced during one more call.
+    """
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        seconds = min(seconds, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return seconds, peak_bytes
+
+
+def benchmarks(args):
+    """
+    Returns a list of (name, function, samples) tuples, where samples is the
+    number of samples processed by one call of the function.
+    """
+    texts = synthetic_corpus(args.n, args.vocabulary, args.length, args.seed)
+    dictionary = p1.bag_of_words(texts)
+    feature_matrix, labels = synthetic_data(args.n, args.d, args.density,
+                                            args.format == 'csr', args.seed)
+    theta, theta_0 = p1.perceptron(feature_matrix, labels, 1, engine='inplace')
+    T = args.T
+    n = args.n
+
+    def tokenize():
+        for text in texts:
+            p1.extract_words(text)
+
+    cases = [
+        ('extract_words', tokenize, n),
+        ('bag_of_words', lambda: p1.bag_of_words(texts), n),
+        ('extract_bow_feature_vectors',
+         lambda: p1.extract_bow_feature_vectors(texts, dictionary), n),
+        ('extract_bow_feature_vectors[sparse]',
+         lambda: p1.extract_bow_feature_vectors(texts, dictionary, sparse_output=True), n),
+    ]
+    for engine in args.engines:
+        cases.append(('perceptron[{}]'.format(engine),
+                      lambda engine=engine: p1.perceptron(feature_matrix, labels, T, engine=engine),
+                      n * T))
+    for engine in args.engines + ['lazy']:
+        cases.append(('average_perceptron[{}]'.format(engine),
+                      lambda engine=engine: p1.average_perceptron(feature_matrix, labels, T, engine=engine),
+                      n * T))
+    for engine in args.engines + ['scaled']:
+        cases.append(('pegasos[{}]'.format(engine),
+                      lambda engine=engine: p1.pegasos(feature_matrix, labels, T, 0.01, engine=engine),
+                      n * T))
+    cases.append(('classify', lambda: p1.classify(feature_matrix, theta, theta_0), n))
+    return [case for case in cases if args.only is None or args.only in case[0]]
+
+
+def run(args):
+    """Runs the benchmarks and returns the results as a JSON serializable dict."""
+    results = []
+    for name, fn, samples in benchmarks(args):
+        seconds, peak_bytes = measure(fn, args.repeat)
+        result = {
+            'name': name,
+            'seconds': seconds,
+            'samples_per_sec': samples / seconds if seconds > 0 else float('inf'),
+            'peak_bytes': peak_bytes,
+        }
+        results.append(result)
+        print('{:<40} {:>10.4f} s {:>14,.0f} samples/s {:>10.1f} MiB'.format(
+            name, seconds, result['samples_per_sec'], peak_bytes / 2**20))
+    config = {key: value for key, value in vars(args).items()
+              if key not in ('output', 'compare', 'only')}
+    return {
+        'config': config,
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline):
+    """
+    Prints the speedup and the memory ratio of every benchmark of report
+    over the benchmark of the same name in baseline.
+    """
+    if report['config'] != baseline['config']:
+        print('Warning: the baseline was run with a different configuration:',
+              baseline['config'], file=sys.stderr)
+    previous = {result['name']: result for result in baseline['results']}
+    print('{:<40} {:>10} {:>10}'.format('benchmark', 'speedup', 'memory'))
+    for result in report['results']:
+        old = previous.get(result['name'])
+        if old is None:
+            continue
+        speedup = old['seconds'] / result['seconds'] if result['seconds'] > 0 else float('inf')
+        memory = result['peak_bytes'] / old['peak_bytes'] if old['peak_bytes'] else float('nan')
+        print('{:<40} {:>9.2f}x {:>9.2f}x'.format(result['name'], speedup, memory))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the project1 featurizers and trainers.')
+    parser.add_argument('--n', type=int, default=4000, help='number of samples')
+    parser.add_argument('--d', type=int, default=2000, help='number of features')
+    parser.add_argument('--density', type=float, default=0.01,
+                        help='fraction of nonzero features')
+    parser.add_argument('--format', choices=['dense', 'csr'], default='dense',
+                        help='storage of the synthetic feature matrix')
+    parser.add_argument('--vocabulary', type=int, default=10000,
+                        help='number of distinct words of the synthetic corpus')
+    parser.add_argument('--length', type=int, default=60, help='words per synthetic review')
+    parser.add_argument('--T', type=int, default=5, help='epochs of the trainers')
+    parser.add_argument('--engines', nargs='+', default=['reference', 'inplace'],
+                        help='training engines to benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', help='only run the benchmarks whose name contains this')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(report, json.load(fp))
+
+
+if __name__ == '__main__':
+    main()
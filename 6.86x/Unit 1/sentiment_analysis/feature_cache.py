@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+import numpy as np
+import scipy.sparse as sparse
+
+import project1 as p1
+import utils
+
+# On-disk cache of the bag-of-words dictionary and feature matrices.
+#
+# An entry is a directory named after the hash of the contents of the input
+# files, the stopwords file and the featurizer settings. The dictionary and
+# every matrix are stored as plain .npy files, loaded back memory-mapped, so a
+# warm start neither reads the TSV files nor tokenizes a single review. The
+# words are stored as in sentiment_model, their UTF-8 bytes concatenated plus
+# the offset of every word, rather than padded to the longest word.
+
+# Bump when the featurization or the layout changes, so stale entries are not
+# reused.
+FORMAT_VERSION = 2
+
+# Prefix of the directories entries are written to before being renamed. They
+# are never entries, even when left behind by an interrupted save.
+TMP_PREFIX = '.tmp-'
+
+
+def file_digest(path, block_size=1 << 20):
+    """Returns the SHA-256 hex digest of the contents of the file at path."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(paths, settings):
+    """
+    Returns the key of the cache entry for the given input files and
+    featurizer settings.
+
+    Args:
+        paths - The files the features are computed from, in order.
+        settings - A JSON serializable dict of featurizer settings.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(
+        {'version': FORMAT_VERSION, 'settings': settings}, sort_keys=True).encode())
+    for path in paths:
+        digest.update(file_digest(path).encode())
+    return digest.hexdigest()
+
+
+def save_matrix(prefix, feature_matrix):
+    """
+    Saves a dense or CSR matrix as .npy files starting with prefix.
+    Returns the metadata needed by load_matrix.
+    """
+    if sparse.issparse(feature_matrix):
+        feature_matrix = sparse.csr_matrix(feature_matrix)
+        np.save(prefix + '.data.npy', feature_matrix.data)
+        np.save(prefix + '.indices.npy', feature_matrix.indices)
+        np.save(prefix + '.indptr.npy', feature_matrix.indptr)
+        return {'sparse': True, 'shape': list(feature_matrix.shape)}
+    np.save(prefix + '.npy', feature_matrix)
+    return {'sparse': False, 'shape': list(feature_matrix.shape)}
+
+
+def save_words(prefix, words):
+    """
+    Saves a list of words as the .npy files of their concatenated UTF-8
+    bytes and of the offset of every word followed by the total length.
+    """
+    encoded = [word.encode() for word in words]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(word) for word in encoded], out=offsets[1:])
+    np.save(prefix + '.npy', np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    np.save(prefix + '.offsets.npy', offsets)
+
+
+def load_words(prefix):
+    """Returns the list of words saved by save_words."""
+    data = np.load(prefix + '.npy').tobytes()
+    offsets = np.load(prefix + '.offsets.npy').tolist()
+    return [data[start:end].decode() for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def load_matrix(prefix, meta, mmap_mode='r'):
+    """Loads a matrix saved by save_matrix, memory-mapping its arrays."""
+    if not meta['sparse']:
+        return np.load(prefix + '.npy', mmap_mode=mmap_mode)
+    return sparse.csr_matrix(
+        (np.load(prefix + '.data.npy', mmap_mode=mmap_mode),
+         np.load(prefix + '.indices.npy', mmap_mode=mmap_mode),
+         np.load(prefix + '.indptr.npy', mmap_mode=mmap_mode)),
+        shape=tuple(meta['shape']), copy=False)
+
+
+class FeatureCache:
+    """
+    Directory of cache entries, each holding a dictionary and a list of
+    (feature_matrix, labels) pairs.
+
+    Args:
+        directory - Where the entries are stored, created when needed.
+    """
+
+    def __init__(self, directory='.feature_cache'):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def keys(self):
+        """Returns the keys of the complete entries."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if not name.startswith(TMP_PREFIX))
+
+    def load(self, key):
+        """
+        Returns (dictionary, [(feature_matrix, labels), ...]) for key, or None
+        when there is no such entry.
+        """
+        if key.startswith(TMP_PREFIX):
+            return None
+        entry = self.path(key)
+        try:
+            with open(os.path.join(entry, 'meta.json')) as fp:
+                meta = json.load(fp)
+        except FileNotFoundError:
+            return None
+        words = load_words(os.path.join(entry, 'words'))
+        dictionary = {word: i for i, word in enumerate(words)}
+        datasets = []
+        for i, matrix_meta in enumerate(meta['matrices']):
+            prefix = os.path.join(entry, str(i))
+            datasets.append((
+                load_matrix(prefix, matrix_meta),
+                np.load(prefix + '.labels.npy', mmap_mode='r')))
+        return dictionary, datasets
+
+    def save(self, key, dictionary, datasets):
+        """
+        Stores the dictionary and the (feature_matrix, labels) pairs under
+        key. The entry is written to a temporary directory first and renamed,
+        so readers never see a partial entry. It is created with the
+        permissions of the umask, so other users can share the cache.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.path(TMP_PREFIX + uuid.uuid4().hex)
+        os.mkdir(tmp)
+        try:
+            save_words(os.path.join(tmp, 'words'), sorted(dictionary, key=dictionary.get))
+            matrices = []
+            for i, (feature_matrix, labels) in enumerate(datasets):
+                prefix = os.path.join(tmp, str(i))
+                matrices.append(save_matrix(prefix, feature_matrix))
+                np.save(prefix + '.labels.npy', np.asarray(labels))
+            with open(os.path.join(tmp, 'meta.json'), 'w') as fp:
+                json.dump({'matrices': matrices}, fp)
+            os.rename(tmp, self.path(key))
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.exists(self.path(key)):
+                raise
+
+
+def load_bow_features(paths, stopwords_path, sparse_output=False,
+                      cache_dir='.feature_cache', n_jobs=1):
+    """
+    Returns the bag-of-words dictionary fitted on the first of paths and the
+    (feature_matrix, labels) pair of every file in paths, reading them from
+    the cache when the files, the stopwords and the settings are unchanged.
+
+    Args:
+        paths - Reviews TSV files, the first one is used to fit the dictionary.
+        stopwords_path - The file with one stopword per line.
+        sparse_output - If True the matrices are scipy.sparse CSR matrices.
+        cache_dir - The directory of the FeatureCache, None to disable it.
+        n_jobs - The number of processes featurizing the reviews on a cache
+            miss. The features do not depend on it.
+    """
+    settings = {'featurizer': 'bag_of_words', 'sparse_output': sparse_output}
+    if cache_dir is not None:
+        cache = FeatureCache(cache_dir)
+        key = cache_key(list(paths) + [stopwords_path], settings)
+        cached = cache.load(key)
+        if cached is not None:
+            return cached
+
+    with open(stopwords_path) as fp:
+        stopwords = fp.read().split('\n')
+    vectorizer = p1.BagOfWordsVectorizer(stopwords, sparse_output=sparse_output, n_jobs=n_jobs)
+    datasets = []
+    for i, path in enumerate(paths):
+        labels, texts = utils.load_data_columns(path)
+        if i == 0:
+            feature_matrix = vectorizer.fit_transform(texts)
+        else:
+            feature_matrix = vectorizer.transform(texts)
+        datasets.append((feature_matrix, labels))
+
+    if cache_dir is not None:
+        cache.save(key, vectorizer.dictionary, datasets)
+    return vectorizer.dictionary, datasets
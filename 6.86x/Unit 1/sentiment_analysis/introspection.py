@@ -0,0 +1,121 @@
+import numpy as np
+import scipy.sparse as sparse
+
+import project1 as p1
+
+# Inspection of trained bag-of-words classifiers.
+#
+# Only the k entries asked for are ever sorted: they are selected with
+# np.argpartition in linear time, so the cost stays low for vocabularies of
+# millions of words. The words are looked up in an index -> word array that
+# is built once per dictionary with word_array and reused across calls.
+#
+# Ties are broken by word, as sorting the (weight, word) pairs would: every
+# value equal to the k-th one is kept as a candidate and the candidates are
+# sorted by (value, word), so the result does not depend on the partition.
+
+
+def word_array(dictionary):
+    """
+    Returns a numpy object array holding the word of every index of
+    dictionary, i.e. the inverse of the dictionary.
+
+    Args:
+        dictionary - A mapping from words to consecutive indices, as built
+            by bag_of_words or a sentiment_model.StringTable.
+    """
+    words = np.empty(len(dictionary), dtype=object)
+    for word, i in dictionary.items():
+        words[i] = word
+    return words
+
+
+def _select(values, k, keys, largest):
+    values = np.asarray(values)
+    k = min(k, len(values))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if largest:
+        kth = values[np.argpartition(-values, k - 1)[k - 1]]
+        candidates = np.flatnonzero(values >= kth)
+    else:
+        kth = values[np.argpartition(values, k - 1)[k - 1]]
+        candidates = np.flatnonzero(values <= kth)
+    ties = candidates if keys is None else np.asarray(keys)[candidates]
+    order = np.lexsort((ties, values[candidates]))
+    if largest:
+        order = order[::-1]
+    return candidates[order[:k]]
+
+
+def top_indices(values, k, keys=None):
+    """
+    Returns the indices of the k largest values, from the largest down. Ties
+    are broken by the largest key first, as in sorted(zip(values, keys))[::-1],
+    or by the largest index when keys is None.
+    """
+    return _select(values, k, keys, largest=True)
+
+
+def bottom_indices(values, k, keys=None):
+    """
+    Returns the indices of the k smallest values, from the smallest up. Ties
+    are broken by the smallest key first, as in sorted(zip(values, keys)),
+    or by the smallest index when keys is None.
+    """
+    return _select(values, k, keys, largest=False)
+
+
+def top_features(theta, words, k=10):
+    """
+    Returns the features with the largest positive and negative weights.
+
+    Args:
+        theta - A numpy array describing the linear classifier.
+        words - The array of the word of every index of theta, see
+            word_array.
+        k - The number of features of each sign.
+
+    Returns: A tuple (positive, negative) of lists of (word, weight) pairs,
+    positive holding the k largest weights from the largest down and negative
+    the k smallest weights from the smallest up, i.e. the ends of the sorted
+    list of (weight, word) pairs.
+    """
+    theta = np.asarray(theta)
+    positive = top_indices(theta, k, words)
+    negative = bottom_indices(theta, k, words)
+    return (list(zip(words[positive].tolist(), theta[positive].tolist())),
+            list(zip(words[negative].tolist(), theta[negative].tolist())))
+
+
+def explain_documents(feature_matrix, theta, words, k=5):
+    """
+    Finds the words contributing most to the classification of every
+    document.
+
+    The contribution of a word to a document is its count times its weight,
+    computed from the nonzero entries of the document only.
+
+    Args:
+        feature_matrix - A numpy matrix or scipy.sparse CSR matrix of
+            bag-of-words features, one document per row.
+        theta - A numpy array describing the linear classifier.
+        words - The array of the word of every index of theta, see
+            word_array.
+        k - The number of words per document.
+
+    Returns: A list with, for every document, the list of its k words with
+    the largest absolute contribution as (word, contribution) pairs, from
+    the largest down, words of equal absolute contribution from the largest
+    word down.
+    """
+    rows = p1.SparseRows(sparse.csr_matrix(feature_matrix))
+    theta = np.asarray(theta)
+    contributions = rows.data * theta[rows.indices]
+    explanations = []
+    for start, end in zip(rows.indptr[:-1].tolist(), rows.indptr[1:].tolist()):
+        values = contributions[start:end]
+        row_words = words[rows.indices[start:end]]
+        top = top_indices(np.abs(values), k, row_words)
+        explanations.append(list(zip(row_words[top].tolist(), values[top].tolist())))
+    return explanations
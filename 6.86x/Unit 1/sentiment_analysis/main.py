@@ -1,5 +1,7 @@
 import project1 as p1
 import utils
+import feature_cache
+import introspection
 import numpy as np
 import pathlib
 
@@ -7,20 +9,12 @@ import pathlib
 # Data loading. There is no need to edit code in this section.
 #-------------------------------------------------------------------------------
 
-train_data = utils.load_data('reviews_train.tsv')
-val_data = utils.load_data('reviews_val.tsv')
-test_data = utils.load_data('reviews_test.tsv')
-
-train_texts, train_labels = zip(*((sample['text'], sample['sentiment']) for sample in train_data))
-val_texts, val_labels = zip(*((sample['text'], sample['sentiment']) for sample in val_data))
-test_texts, test_labels = zip(*((sample['text'], sample['sentiment']) for sample in test_data))
-
-stop_words = open(pathlib.Path(__file__).parent / 'stopwords.txt').read().split('\n')
-dictionary = p1.bag_of_words(train_texts, stop_words)
-
-train_bow_features = p1.extract_bow_feature_vectors(train_texts, dictionary)
-val_bow_features = p1.extract_bow_feature_vectors(val_texts, dictionary)
-test_bow_features = p1.extract_bow_feature_vectors(test_texts, dictionary)
+stop_words_path = pathlib.Path(__file__).parent / 'stopwords.txt'
+dictionary, datasets = feature_cache.load_bow_features(
+    ['reviews_train.tsv', 'reviews_val.tsv', 'reviews_test.tsv'], stop_words_path,
+    sparse_output=True)
+(train_bow_features, train_labels), (val_bow_features, val_labels), \
+    (test_bow_features, test_labels) = datasets
 
 #-------------------------------------------------------------------------------
 # Problem 5
@@ -70,8 +64,8 @@ print('Test accuracy:', test_accuracy)
 #-------------------------------------------------------------------------------
 
 best_theta = theta
-wordlist   = [word for (idx, word) in sorted(zip(dictionary.values(), dictionary.keys()))]
-sorted_word_features = utils.most_explanatory_word(best_theta, wordlist)
+wordlist   = introspection.word_array(dictionary)
+sorted_word_features = utils.most_explanatory_word(best_theta, wordlist, k=10)
 print("Most Explanatory Word Features")
 print(sorted_word_features[:10])
 
@@ -1,21 +1,28 @@
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from string import punctuation, digits
-import numpy as np
+import queue
+import os
 import random
+import re
+import threading
+import time
+import zlib
+import numpy as np
+import scipy.sparse as sparse
+import sampling
 
 # Part I
 
 
 #pragma: coderesponse template
 def get_order(n_samples):
-    try:
-        with open(str(n_samples) + '.txt') as fp:
-            line = fp.readline()
-            return list(map(int, line.split(',')))
-    except FileNotFoundError:
-        random.seed(1)
-        indices = list(range(n_samples))
-        random.shuffle(indices)
-        return indices
+    """
+    Returns the order in which the trainers visit the samples: the indices
+    in `<n_samples>.txt` when that file exists, otherwise range(n_samples)
+    shuffled with seed 1. The order is memoized by sampling.cached_order.
+    """
+    return sampling.cached_order(n_samples).tolist()
 #pragma: coderesponse end
 
 
@@ -49,8 +56,8 @@ def hinge_loss_full(feature_matrix, labels, theta, theta_0):
     parameters.
 
     Args:
-        feature_matrix - A numpy matrix describing the given data. Each row
-            represents a single data point.
+        feature_matrix - A numpy matrix or scipy.sparse CSR matrix describing
+            the given data. Each row represents a single data point.
         labels - A numpy array where the kth element of the array is the
             correct classification of the kth row of the feature matrix.
         theta - A numpy array describing the linear classifier.
@@ -100,11 +107,12 @@ def perceptron_single_step_update(
 
 
 #pragma: coderesponse template
-def perceptron(feature_matrix, labels, T):
+def perceptron(feature_matrix, labels, T, engine='reference', checkpoints=None,
+               sampler=None, stop_mistake_rate=None, history=None,
+               callbacks=None, callback_every=None, initial=None):
     """
     Runs the full perceptron algorithm on a given set of data. Runs T
-    iterations through the data set, there is no need to worry about
-    stopping early.
+    iterations through the data set, unless stop_mistake_rate is given.
 
     NOTE: Please use the previously implemented functions when applicable.
     Do not copy paste code from previous parts.
@@ -112,12 +120,38 @@ def perceptron(feature_matrix, labels, T):
     NOTE: Iterate the data matrix by the orders returned by get_order(feature_matrix.shape[0])
 
     Args:
-        feature_matrix -  A numpy matrix describing the given data. Each row
-            represents a single data point.
+        feature_matrix -  A numpy matrix or scipy.sparse CSR matrix describing
+            the given data. Each row represents a single data point.
         labels - A numpy array where the kth element of the array is the
             correct classification of the kth row of the feature matrix.
         T - An integer indicating how many times the perceptron algorithm
             should iterate through the feature matrix.
+        engine - The name of the training kernel to use, see ENGINES.
+            'reference' calls perceptron_single_step_update for every sample,
+            'inplace' updates preallocated buffers and gives identical
+            results without allocating a new theta per sample.
+        checkpoints - Optional list of epoch counts between 1 and T. When
+            given, the result after each of those epochs is recorded during
+            the single run and a list of (theta, theta_0) tuples, one per
+            checkpoint, is returned instead of a single tuple.
+        sampler - Optional sampling.Sampler providing the order of the
+            samples of each epoch. Defaults to the order of get_order.
+        stop_mistake_rate - Optional fraction of the samples. Training stops
+            after the first epoch whose mistakes are at most this fraction, 0
+            meaning an epoch without mistakes. Checkpoints after that epoch
+            get the final result.
+        history - Optional list to which a dict with the 'epoch' number, the
+            number of 'mistakes' made during the epoch and the total number
+            of 'updates' so far is appended after every epoch.
+        callbacks - Optional list of functions called with the statistics of
+            TrainingMonitor after every epoch, 'updates' counting mistakes.
+        callback_every - Optional number of samples between additional calls
+            of the callbacks.
+        initial - Optional (theta, theta_0) tuple to continue training from,
+            e.g. the result of a previous call. A theta with fewer weights
+            than the feature matrix has columns, trained before the
+            dictionary grew, is extended with zero weights. theta can be a
+            GrowableTheta, see there.
 
     Returns: A tuple where the first element is a numpy array with the value of
     theta, the linear classification parameter, after T iterations through the
@@ -126,21 +160,47 @@ def perceptron(feature_matrix, labels, T):
     the feature matrix.
     """
     # Your code here
-    theta = np.zeros(feature_matrix[0].shape[0])
-    theta_0 = 0
+    labels = label_list(labels)
+    kernel = make_kernel(engine, feature_matrix, initial)
+    rows = kernel.rows(feature_matrix)
+    sampler = sampler or sampling.DEFAULT_SAMPLER
+    epochs = checkpoint_epochs(checkpoints, T)
+    snapshots = {}
+    monitor = make_monitor(callbacks, callback_every, feature_matrix, labels)
+    updates = 0
     for t in range(T):
-        for i in get_order(feature_matrix.shape[0]):
-            theta, theta_0 = perceptron_single_step_update(feature_matrix[i], labels[i], theta, theta_0)
-    return (theta, theta_0)
+        mistakes = 0
+        order = sampler.order(feature_matrix.shape[0], t, labels).tolist()
+        for block in (order,) if monitor is None else monitor.blocks(order):
+            for i in block:
+                mistakes += kernel.perceptron_step(rows[i], labels[i])
+            if monitor is not None:
+                monitor.block_done(len(block), t + 1, updates + mistakes, kernel)
+        updates = updates + mistakes
+        if history is not None:
+            history.append({'epoch': t + 1, 'mistakes': mistakes, 'updates': updates})
+        if monitor is not None:
+            monitor.report('epoch', t + 1, updates, kernel)
+        if t + 1 in epochs:
+            snapshots[t + 1] = (np.copy(kernel.theta), kernel.theta_0)
+        if converged(mistakes, len(labels), stop_mistake_rate):
+            break
+    theta = store_weights(initial, kernel)
+    if checkpoints is not None:
+        return [snapshots.get(epoch, (theta, kernel.theta_0)) for epoch in checkpoints]
+    return (theta, kernel.theta_0)
 #pragma: coderesponse end
 
 
 #pragma: coderesponse template
-def average_perceptron(feature_matrix, labels, T):
+def average_perceptron(feature_matrix, labels, T, engine='reference',
+                       checkpoints=None, sampler=None, stop_mistake_rate=None,
+                       history=None, callbacks=None, callback_every=None,
+                       initial=None):
     """
     Runs the average perceptron algorithm on a given set of data. Runs T
-    iterations through the data set, there is no need to worry about
-    stopping early.
+    iterations through the data set, unless stop_mistake_rate is given, in
+    which case theta is averaged over the epochs that were run.
 
     NOTE: Please use the previously implemented functions when applicable.
     Do not copy paste code from previous parts.
@@ -149,12 +209,36 @@ def average_perceptron(feature_matrix, labels, T):
 
 
     Args:
-        feature_matrix -  A numpy matrix describing the given data. Each row
-            represents a single data point.
+        feature_matrix -  A numpy matrix or scipy.sparse CSR matrix describing
+            the given data. Each row represents a single data point.
         labels - A numpy array where the kth element of the array is the
             correct classification of the kth row of the feature matrix.
         T - An integer indicating how many times the perceptron algorithm
             should iterate through the feature matrix.
+        engine - The name of the training kernel to use, see ENGINES.
+            'lazy' recovers the average from an accumulator that only
+            changes on mistakes instead of summing theta after every sample.
+        checkpoints - Optional list of epoch counts between 1 and T. When
+            given, the result after each of those epochs is recorded during
+            the single run and a list of (theta, theta_0) tuples, one per
+            checkpoint, is returned instead of a single tuple.
+        sampler - Optional sampling.Sampler providing the order of the
+            samples of each epoch. Defaults to the order of get_order.
+        stop_mistake_rate - Optional fraction of the samples. Training stops
+            after the first epoch whose mistakes are at most this fraction, 0
+            meaning an epoch without mistakes. Checkpoints after that epoch
+            get the final result.
+        history - Optional list to which a dict with the 'epoch' number, the
+            number of 'mistakes' made during the epoch and the total number
+            of 'updates' so far is appended after every epoch.
+        callbacks - Optional list of functions called with the statistics of
+            TrainingMonitor after every epoch, 'updates' counting mistakes
+            and theta being the current, not the averaged, theta.
+        callback_every - Optional number of samples between additional calls
+            of the callbacks.
+        initial - Optional (theta, theta_0) tuple to continue training from,
+            extended with zero weights like in perceptron. Only the epochs
+            of this call are averaged.
 
     Returns: A tuple where the first element is a numpy array with the value of
     the average theta, the linear classification parameter, found after T
@@ -167,20 +251,39 @@ def average_perceptron(feature_matrix, labels, T):
     """
     # Your code here
     n = feature_matrix.shape[0]
-    num_features = feature_matrix[0].shape[0]
-    theta_sum = np.zeros(num_features)
-    theta_0_sum = 0
-    theta = np.zeros(num_features)
-    theta_0 = 0
+    labels = label_list(labels)
+    kernel = make_kernel(engine, feature_matrix, initial)
+    rows = kernel.rows(feature_matrix)
+    sampler = sampler or sampling.DEFAULT_SAMPLER
+    epochs = checkpoint_epochs(checkpoints, T)
+    snapshots = {}
+    monitor = make_monitor(callbacks, callback_every, feature_matrix, labels)
+    updates = 0
+    epochs_run = 0
     for t in range(T):
-        for i in get_order(n):
-            theta, theta_0 = perceptron_single_step_update(feature_matrix[i], labels[i], theta, theta_0)
-            theta_sum = theta_sum + theta
-            theta_0_sum = theta_0_sum + theta_0
-    
-    theta = theta_sum / (T * n)
-    theta_0 = theta_0_sum / (T * n)
-    return (theta, theta_0)
+        mistakes = 0
+        order = sampler.order(n, t, labels).tolist()
+        for block in (order,) if monitor is None else monitor.blocks(order):
+            for i in block:
+                mistakes += kernel.perceptron_step(rows[i], labels[i])
+                kernel.accumulate()
+            if monitor is not None:
+                monitor.block_done(len(block), t + 1, updates + mistakes, kernel)
+        updates = updates + mistakes
+        epochs_run = t + 1
+        if history is not None:
+            history.append({'epoch': t + 1, 'mistakes': mistakes, 'updates': updates})
+        if monitor is not None:
+            monitor.report('epoch', t + 1, updates, kernel)
+        if t + 1 in epochs:
+            snapshots[t + 1] = kernel.average((t + 1) * n)
+        if converged(mistakes, n, stop_mistake_rate):
+            break
+    store_weights(initial, kernel)
+    result = kernel.average(epochs_run * n)
+    if checkpoints is not None:
+        return [snapshots.get(epoch, result) for epoch in checkpoints]
+    return result
 #pragma: coderesponse end
 
 
@@ -223,7 +326,8 @@ def pegasos_single_step_update(
 
 
 #pragma: coderesponse template
-def pegasos(feature_matrix, labels, T, L):
+def pegasos(feature_matrix, labels, T, L, engine='reference', checkpoints=None,
+            sampler=None, callbacks=None, callback_every=None, initial=None):
     """
     Runs the Pegasos algorithm on a given set of data. Runs T
     iterations through the data set, there is no need to worry about
@@ -237,14 +341,34 @@ def pegasos(feature_matrix, labels, T, L):
     Do not copy paste code from previous parts.
 
     Args:
-        feature_matrix - A numpy matrix describing the given data. Each row
-            represents a single data point.
+        feature_matrix - A numpy matrix or scipy.sparse CSR matrix describing
+            the given data. Each row represents a single data point.
         labels - A numpy array where the kth element of the array is the
             correct classification of the kth row of the feature matrix.
         T - An integer indicating how many times the algorithm
             should iterate through the feature matrix.
         L - The lamba value being used to update the Pegasos
             algorithm parameters.
+        engine - The name of the training kernel to use, see ENGINES.
+            'scaled' stores theta as scale * vector so the decay of each
+            step is O(1) and the update is O(nnz) on CSR input.
+        checkpoints - Optional list of epoch counts between 1 and T. When
+            given, the result after each of those epochs is recorded during
+            the single run and a list of (theta, theta_0) tuples, one per
+            checkpoint, is returned instead of a single tuple.
+        sampler - Optional sampling.Sampler providing the order of the
+            samples of each epoch. Defaults to the order of get_order.
+        callbacks - Optional list of functions called with the statistics of
+            TrainingMonitor after every epoch, 'updates' counting the steps
+            whose sample violated the margin, as the mistakes of perceptron.
+        callback_every - Optional number of samples between additional calls
+            of the callbacks.
+        initial - Optional (theta, theta_0, updates) tuple to continue
+            training from, where updates is the number of steps taken so far,
+            e.g. T * n of the previous call, so the learning rate carries on
+            from 1/sqrt(updates + 1). theta is extended with zero weights
+            like in perceptron. A (theta, theta_0) tuple restarts the
+            learning rate at 1.
 
     Returns: A tuple where the first element is a numpy array with the value of
     the theta, the linear classification parameter, found after T
@@ -253,16 +377,1158 @@ def pegasos(feature_matrix, labels, T, L):
     parameter, found after T iterations through the feature matrix.
     """
     # Your code here
-    theta = np.zeros(feature_matrix[0].shape[0])
-    theta_0 = 0
+    labels = label_list(labels)
+    kernel = make_kernel(engine, feature_matrix, initial)
+    rows = kernel.rows(feature_matrix)
+    sampler = sampler or sampling.DEFAULT_SAMPLER
+    epochs = checkpoint_epochs(checkpoints, T)
+    snapshots = {}
+    monitor = make_monitor(callbacks, callback_every, feature_matrix, labels)
+    steps = initial[2] if initial is not None and len(initial) > 2 else 0
     updates = 0
     for t in range(T):
-        for i in get_order(feature_matrix.shape[0]):
+        order = sampler.order(feature_matrix.shape[0], t, labels).tolist()
+        for block in (order,) if monitor is None else monitor.blocks(order):
+            for i in block:
+                steps = steps + 1
+                eta = 1 / np.sqrt(steps)
+                updates += kernel.pegasos_step(rows[i], labels[i], L, eta)
+            if monitor is not None:
+                monitor.block_done(len(block), t + 1, updates, kernel)
+        if monitor is not None:
+            monitor.report('epoch', t + 1, updates, kernel)
+        if t + 1 in epochs:
+            snapshots[t + 1] = (np.copy(kernel.theta), kernel.theta_0)
+    theta = store_weights(initial, kernel)
+    if checkpoints is not None:
+        return [snapshots[epoch] for epoch in checkpoints]
+    return (theta, kernel.theta_0)
+#pragma: coderesponse end
+
+
+def label_list(labels):
+    """
+    Returns labels as a list of Python numbers. Labels loaded as np.int8
+    would otherwise make theta_0 an np.int8 that overflows after 127
+    updates, and indexing a list is also faster than indexing an array in
+    the training loops.
+    """
+    return np.asarray(labels).tolist()
+
+
+def converged(mistakes, n_samples, stop_mistake_rate):
+    """
+    Returns whether an epoch with the given number of mistakes meets the
+    stop_mistake_rate criterion of the perceptron trainers. Always False
+    when stop_mistake_rate is None.
+    """
+    return stop_mistake_rate is not None and mistakes <= stop_mistake_rate * n_samples
+
+
+def checkpoint_epochs(checkpoints, T):
+    """
+    Validates the checkpoints argument of the trainers and returns the set of
+    epochs after which a snapshot has to be taken.
+
+    Args:
+        checkpoints - None or a list of integers between 1 and T.
+        T - The number of epochs the trainer runs.
+    """
+    if checkpoints is None:
+        return set()
+    epochs = set(checkpoints)
+    if not all(1 <= epoch <= T for epoch in epochs):
+        raise ValueError(
+            'Checkpoints must be between 1 and T = {}, got {}.'.format(T, checkpoints))
+    return epochs
+
+
+def extended_theta(theta, num_features):
+    """
+    Returns a new float numpy array of length num_features holding theta
+    followed by zeros, the weights of the words added to the dictionary
+    after theta was trained. theta can also be a GrowableTheta.
+    """
+    if isinstance(theta, GrowableTheta):
+        theta = theta.theta
+    theta = np.asarray(theta, dtype=float)
+    if len(theta) > num_features:
+        raise ValueError('theta has {} weights but the feature matrix only {} columns.'.format(
+            len(theta), num_features))
+    extended = np.zeros(num_features)
+    extended[:len(theta)] = theta
+    return extended
+
+
+class GrowableTheta:
+    """
+    The theta of a classifier whose dictionary keeps growing. The weights are
+    the start of a larger buffer whose capacity doubles when it is exceeded,
+    so adding zero weights for new words costs amortized O(1) per word and
+    theta is a view of the buffer that is never copied to be read.
+
+    Given as the theta of the initial argument of the trainers, it is grown
+    to the columns of the feature matrix and the 'inplace', 'lazy' and
+    sparse engines train directly in its buffer. The other engines copy
+    their final weights back, so it always ends up holding the current
+    weights, ready for the next call. The theta returned by the trainers is
+    a copy, which later calls do not change.
+
+    Args:
+        theta - The initial weights, none by default.
+    """
+
+    def __init__(self, theta=()):
+        theta = np.asarray(theta, dtype=float)
+        self.size = len(theta)
+        self._buffer = np.zeros(max(16, 2 * self.size))
+        self._buffer[:self.size] = theta
+
+    @property
+    def theta(self):
+        return self._buffer[:self.size]
+
+    @property
+    def capacity(self):
+        return len(self._buffer)
+
+    def grow(self, num_features):
+        """
+        Extends theta with zero weights to num_features weights, if it is
+        shorter, and returns it.
+        """
+        if num_features > self.capacity:
+            buffer = np.zeros(max(num_features, 2 * self.capacity))
+            buffer[:self.size] = self.theta
+            self._buffer = buffer
+        self.size = max(self.size, num_features)
+        return self.theta
+
+    def view(self, num_features):
+        """
+        Returns theta grown to num_features weights, to be updated in place.
+        """
+        if self.size > num_features:
+            raise ValueError('theta has {} weights but the feature matrix only {} columns.'.format(
+                self.size, num_features))
+        return self.grow(num_features)
+
+    def assign(self, theta):
+        """
+        Replaces the weights by theta, growing them to its length. Nothing is
+        copied when theta is a view of the buffer, as after training in place.
+        """
+        if np.may_share_memory(theta, self._buffer):
+            return
+        self.grow(len(theta))
+        self._buffer[:len(theta)] = theta
+        self._buffer[len(theta):self.size] = 0
+
+
+def store_weights(initial, kernel):
+    """
+    Leaves the current weights of kernel in the GrowableTheta of the initial
+    argument of a trainer, if it has one. Returns the theta the trainer
+    returns, copied out of the buffer of the GrowableTheta when the kernel
+    trained in it, so that training it further does not change the result.
+    """
+    theta = kernel.theta
+    if initial is not None and isinstance(initial[0], GrowableTheta):
+        initial[0].assign(theta)
+        if np.may_share_memory(theta, initial[0]._buffer):
+            theta = np.copy(theta)
+    return theta
+
+
+# Training telemetry
+#
+# The trainers accept a list of callbacks, called with a dict of statistics
+# after every epoch and, with callback_every, every that many samples. The
+# sample loop is only split into blocks when callbacks are registered, so
+# training without them runs exactly the same loop as before.
+
+# Number of samples the hinge loss reported to the callbacks is computed on.
+TELEMETRY_LOSS_SAMPLES = 1000
+
+
+class TrainingMonitor:
+    """
+    Reports the progress of a trainer to callbacks. Each callback receives a
+    dict with:
+        'event' - 'epoch' at the end of an epoch, 'samples' every `every`
+            samples.
+        'epoch' - The current epoch, starting at 1.
+        'samples' - The number of samples processed so far.
+        'updates' - The number of updates so far, as counted by the trainer.
+        'wall_time' - The seconds elapsed since training started.
+        'samples_per_sec' - The throughput since the previous report of the
+            same event, not counting the time spent computing statistics.
+        'hinge_loss' - hinge_loss_full of the current theta and theta_0 on a
+            fixed random subset of the samples.
+        'theta_norm' - The norm of the current theta.
+
+    Args:
+        callbacks - A list of functions taking the statistics dict.
+        feature_matrix - The feature matrix being trained on.
+        labels - The labels being trained on.
+        every - Optional number of samples between 'samples' reports.
+        loss_samples - The size of the subset the hinge loss is computed on,
+            None for all the samples.
+        seed - The seed of the subset.
+    """
+
+    def __init__(self, callbacks, feature_matrix, labels, every=None,
+                 loss_samples=TELEMETRY_LOSS_SAMPLES, seed=0):
+        if every is not None and every < 1:
+            raise ValueError('callback_every must be a positive number of samples.')
+        self.callbacks = list(callbacks)
+        self.every = every
+        n = feature_matrix.shape[0]
+        labels = np.asarray(labels)
+        if loss_samples is None or loss_samples >= n:
+            self.loss_matrix, self.loss_labels = feature_matrix, labels
+        else:
+            subset = np.sort(np.random.RandomState(seed).choice(n, loss_samples, replace=False))
+            self.loss_matrix, self.loss_labels = feature_matrix[subset], labels[subset]
+        self.samples = 0
+        self.start = time.perf_counter()
+        # The (time, samples) of the previous report of each event
+        self._last = {}
+
+    def blocks(self, order):
+        """
+        Splits the order of an epoch into blocks ending every `every`
+        samples, counting from the start of training.
+        """
+        if self.every is None:
+            return [order]
+        blocks = []
+        start = 0
+        end = self.every - self.samples % self.every
+        while start < len(order):
+            blocks.append(order[start:end])
+            start, end = end, end + self.every
+        return blocks
+
+    def block_done(self, size, epoch, updates, kernel):
+        """Records a finished block and reports every `every` samples."""
+        self.samples += size
+        if self.every is not None and self.samples % self.every == 0:
+            self.report('samples', epoch, updates, kernel)
+
+    def report(self, event, epoch, updates, kernel):
+        """Calls the callbacks with the statistics of the current state."""
+        now = time.perf_counter()
+        last_time, last_samples = self._last.get(event, (self.start, 0))
+        elapsed = now - last_time
+        theta = kernel.theta
+        stats = {
+            'event': event,
+            'epoch': epoch,
+            'samples': self.samples,
+            'updates': updates,
+            'wall_time': now - self.start,
+            'samples_per_sec': (self.samples - last_samples) / elapsed if elapsed > 0 else float('inf'),
+            'hinge_loss': float(hinge_loss_full(
+                self.loss_matrix, self.loss_labels, theta, kernel.theta_0)),
+            'theta_norm': theta_norm(kernel),
+        }
+        for callback in self.callbacks:
+            callback(stats)
+        self._last[event] = (time.perf_counter(), self.samples)
+
+
+def theta_norm(kernel):
+    """
+    Returns the norm of the theta of kernel, from the squared norm it keeps
+    track of when it has one, as ScaledKernel.
+    """
+    norm_sq = getattr(kernel, 'norm_sq', None)
+    if norm_sq is None:
+        return float(np.linalg.norm(kernel.theta))
+    # The running sum can drift just below 0 when theta is close to 0
+    return float(np.sqrt(max(norm_sq, 0.0)))
+
+
+def make_monitor(callbacks, callback_every, feature_matrix, labels):
+    """
+    Returns the TrainingMonitor of a trainer, or None when no callbacks are
+    registered.
+    """
+    if not callbacks:
+        return None
+    return TrainingMonitor(callbacks, feature_matrix, labels, callback_every)
+
+
+# Training kernels
+#
+# The trainers above only decide the order of the samples and the learning
+# rate; the state of the classifier and the update arithmetic live in a
+# kernel, selected per call with the `engine` argument.
+
+
+class ReferenceKernel:
+    """
+    Kernel that calls the single step update functions for every sample and
+    rebinds theta to the freshly allocated array they return.
+
+    Args:
+        num_features - The number of columns of the feature matrix.
+    """
+
+    def __init__(self, num_features):
+        self.theta = np.zeros(num_features)
+        self.theta_0 = 0
+        self.theta_sum = np.zeros(num_features)
+        self.theta_0_sum = 0
+
+    def rows(self, feature_matrix):
+        """Returns the rows of feature_matrix in the form the steps expect."""
+        return feature_matrix
+
+    def start_from(self, theta, theta_0):
+        """Replaces the zero parameters by the given ones."""
+        self.theta = extended_theta(theta, len(self.theta))
+        self.theta_0 = theta_0
+
+    def perceptron_step(self, feature_vector, label):
+        """
+        Runs one perceptron step. Returns True if the sample was a mistake
+        and the parameters were updated.
+        """
+        theta_0 = self.theta_0
+        self.theta, self.theta_0 = perceptron_single_step_update(
+            feature_vector, label, self.theta, self.theta_0)
+        return self.theta_0 != theta_0
+
+    def pegasos_step(self, feature_vector, label, L, eta):
+        """
+        Runs one Pegasos step. Returns True if the sample violated the margin
+        and the hinge loss term updated the parameters.
+        """
+        theta_0 = self.theta_0
+        self.theta, self.theta_0 = pegasos_single_step_update(
+            feature_vector, label, L, eta, self.theta, self.theta_0)
+        return self.theta_0 != theta_0
+
+    def accumulate(self):
+        """Adds the current parameters to the running sums."""
+        self.theta_sum = self.theta_sum + self.theta
+        self.theta_0_sum = self.theta_0_sum + self.theta_0
+
+    def average(self, count):
+        """Returns the running sums divided by count as (theta, theta_0)."""
+        return (self.theta_sum / count, self.theta_0_sum / count)
+
+
+class InPlaceKernel(ReferenceKernel):
+    """
+    Kernel that owns its theta, theta_sum and scratch buffers and updates them
+    with out= ufuncs. The arithmetic is performed in the same order as in the
+    single step update functions, so the results are bit-identical to
+    ReferenceKernel.
+
+    Args:
+        num_features - The number of columns of the feature matrix.
+    """
+
+    def __init__(self, num_features):
+        super().__init__(num_features)
+        self._scratch = np.empty(num_features)
+
+    def start_from(self, theta, theta_0):
+        if isinstance(theta, GrowableTheta):
+            self.theta = theta.view(len(self.theta))
+            self.theta_0 = theta_0
+        else:
+            super().start_from(theta, theta_0)
+
+    def perceptron_step(self, feature_vector, label):
+        if label * ((self.theta @ feature_vector) + self.theta_0) <= 0:
+            np.multiply(feature_vector, label, out=self._scratch)
+            np.add(self.theta, self._scratch, out=self.theta)
+            self.theta_0 = self.theta_0 + label
+            return True
+        return False
+
+    def pegasos_step(self, feature_vector, label, L, eta):
+        violated = label * (self.theta @ feature_vector + self.theta_0) <= 1
+        np.multiply(self.theta, 1 - eta * L, out=self.theta)
+        if violated:
+            np.multiply(feature_vector, eta * label, out=self._scratch)
+            np.add(self.theta, self._scratch, out=self.theta)
+            self.theta_0 = self.theta_0 + eta * label
+        return violated
+
+    def accumulate(self):
+        np.add(self.theta_sum, self.theta, out=self.theta_sum)
+        self.theta_0_sum = self.theta_0_sum + self.theta_0
+
+
+class SparseRows:
+    """
+    Row accessor over a CSR matrix. Indexing returns the pair
+    (column indices, values) of the nonzero entries of that row as views
+    into the CSR arrays, so reading a row costs O(1).
+
+    Args:
+        feature_matrix - A scipy.sparse matrix, converted to canonical CSR
+            (sorted, without duplicate columns) if it is not already.
+    """
+
+    def __init__(self, feature_matrix):
+        feature_matrix = sparse.csr_matrix(feature_matrix)
+        if not feature_matrix.has_canonical_format:
+            feature_matrix = feature_matrix.copy()
+            feature_matrix.sum_duplicates()
+        self.indptr = feature_matrix.indptr
+        self.indices = feature_matrix.indices
+        self.data = feature_matrix.data
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, i):
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return (self.indices[start:end], self.data[start:end])
+
+
+class SparseKernel(InPlaceKernel):
+    """
+    Kernel for CSR feature matrices. Each sample is a (column indices, values)
+    pair from SparseRows, and the perceptron update only touches the nonzero
+    columns of the sample. The Pegasos decay and the averaging still update
+    every column in place.
+
+    Args:
+        num_features - The number of columns of the feature matrix.
+    """
+
+    def rows(self, feature_matrix):
+        return SparseRows(feature_matrix)
+
+    def perceptron_step(self, row, label):
+        indices, values = row
+        if label * ((self.theta[indices] @ values) + self.theta_0) <= 0:
+            self.theta[indices] += label * values
+            self.theta_0 = self.theta_0 + label
+            return True
+        return False
+
+    def pegasos_step(self, row, label, L, eta):
+        indices, values = row
+        violated = label * (self.theta[indices] @ values + self.theta_0) <= 1
+        np.multiply(self.theta, 1 - eta * L, out=self.theta)
+        if violated:
+            self.theta[indices] += eta * label * values
+            self.theta_0 = self.theta_0 + eta * label
+        return violated
+
+
+class DenseRows:
+    """
+    Row accessor over a dense matrix that returns (slice(None), row) pairs,
+    so kernels written against SparseRows pairs also accept dense input.
+
+    Args:
+        feature_matrix - A numpy matrix.
+    """
+
+    def __init__(self, feature_matrix):
+        self.feature_matrix = feature_matrix
+
+    def __len__(self):
+        return self.feature_matrix.shape[0]
+
+    def __getitem__(self, i):
+        return (slice(None), self.feature_matrix[i])
+
+
+class ScaledKernel:
+    """
+    Kernel that stores theta as scale * vector and keeps track of the squared
+    norm of theta. The Pegasos decay (1 - eta * L) only multiplies the scalar,
+    so a step costs O(1) plus O(nnz) when the sample is inside the margin.
+    theta is materialized from the two factors when it is read, which the
+    trainers only do once training ends, and the squared norm gives the
+    'theta_norm' of TrainingMonitor without materializing it.
+
+    The results match ReferenceKernel up to floating-point rounding.
+
+    Args:
+        num_features - The number of columns of the feature matrix.
+    """
+
+    # Below this magnitude the scale is folded back into the vector, so the
+    # 1 / scale factors applied to new samples stay well conditioned.
+    MIN_SCALE = 1e-9
+
+    def __init__(self, num_features):
+        self.scale = 1.0
+        self.norm_sq = 0.0
+        self.theta_0 = 0
+        self.theta_sum = np.zeros(num_features)
+        self.theta_0_sum = 0
+        self._vector = np.zeros(num_features)
+        self._scratch = np.empty(num_features)
+
+    @property
+    def theta(self):
+        return self.scale * self._vector
+
+    def start_from(self, theta, theta_0):
+        self._vector = extended_theta(theta, len(self._vector))
+        self.scale = 1.0
+        self.norm_sq = self._vector @ self._vector
+        self.theta_0 = theta_0
+
+    def rows(self, feature_matrix):
+        if sparse.issparse(feature_matrix):
+            return SparseRows(feature_matrix)
+        return DenseRows(feature_matrix)
+
+    def _decay(self, factor):
+        """Multiplies theta by factor."""
+        if factor == 0:
+            self._vector[:] = 0
+            self.scale = 1.0
+            self.norm_sq = 0.0
+            return
+        self.scale = self.scale * factor
+        self.norm_sq = self.norm_sq * factor * factor
+        if abs(self.scale) < self.MIN_SCALE:
+            np.multiply(self._vector, self.scale, out=self._vector)
+            self.scale = 1.0
+            self.norm_sq = self._vector @ self._vector
+
+    def _add(self, indices, values, step, dot):
+        """
+        Adds step * values to the given columns of theta, where dot is the
+        current product of theta with the sample.
+        """
+        self._vector[indices] += (step / self.scale) * values
+        self.norm_sq = (self.norm_sq + 2 * step * dot
+                        + step * step * (values @ values))
+
+    def perceptron_step(self, row, label):
+        indices, values = row
+        dot = self.scale * (self._vector[indices] @ values)
+        if label * (dot + self.theta_0) <= 0:
+            self._add(indices, values, label, dot)
+            self.theta_0 = self.theta_0 + label
+            return True
+        return False
+
+    def pegasos_step(self, row, label, L, eta):
+        indices, values = row
+        dot = self.scale * (self._vector[indices] @ values)
+        violated = label * (dot + self.theta_0) <= 1
+        decay = 1 - eta * L
+        self._decay(decay)
+        if violated:
+            self._add(indices, values, eta * label, decay * dot)
+            self.theta_0 = self.theta_0 + eta * label
+        return violated
+
+    def accumulate(self):
+        np.multiply(self._vector, self.scale, out=self._scratch)
+        np.add(self.theta_sum, self._scratch, out=self.theta_sum)
+        self.theta_0_sum = self.theta_0_sum + self.theta_0
+
+    def average(self, count):
+        return (self.theta_sum / count, self.theta_0_sum / count)
+
+
+class LazyAverageKernel:
+    """
+    Perceptron kernel that averages without summing theta after every sample.
+
+    If the update delta_k is made at step k, it is part of theta at steps
+    k, ..., N, so the sum of theta over N steps is
+    N * theta_N - sum_k (k - 1) * delta_k. The second term is kept in a
+    weighted accumulator that only changes on mistakes, so accumulate() is
+    O(1) and a mistake costs O(nnz). The average is recovered exactly (up to
+    floating-point rounding) by average().
+
+    Args:
+        num_features - The number of columns of the feature matrix.
+    """
+
+    def __init__(self, num_features):
+        self.theta = np.zeros(num_features)
+        self.theta_0 = 0
+        self.count = 0
+        self._weighted = np.zeros(num_features)
+        self._weighted_0 = 0
+
+    def rows(self, feature_matrix):
+        if sparse.issparse(feature_matrix):
+            return SparseRows(feature_matrix)
+        return DenseRows(feature_matrix)
+
+    def perceptron_step(self, row, label):
+        indices, values = row
+        if label * ((self.theta[indices] @ values) + self.theta_0) <= 0:
+            self.theta[indices] += label * values
+            self.theta_0 = self.theta_0 + label
+            self._weighted[indices] += (self.count * label) * values
+            self._weighted_0 = self._weighted_0 + self.count * label
+            return True
+        return False
+
+    def pegasos_step(self, row, label, L, eta):
+        raise ValueError('The lazy engine only supports the perceptron family.')
+
+    def start_from(self, theta, theta_0):
+        # The average stays exact: the sum of theta over N steps is still
+        # N * theta_N - sum_k (k - 1) * delta_k when theta does not start at 0
+        if isinstance(theta, GrowableTheta):
+            self.theta = theta.view(len(self.theta))
+        else:
+            self.theta = extended_theta(theta, len(self.theta))
+        self.theta_0 = theta_0
+
+    def accumulate(self):
+        self.count = self.count + 1
+
+    def average(self, count):
+        theta_sum = self.count * self.theta - self._weighted
+        theta_0_sum = self.count * self.theta_0 - self._weighted_0
+        return (theta_sum / count, theta_0_sum / count)
+
+
+ENGINES = {
+    'reference': ReferenceKernel,
+    'inplace': InPlaceKernel,
+    'scaled': ScaledKernel,
+    'lazy': LazyAverageKernel,
+}
+
+# Kernels used in place of ENGINES when the feature matrix is sparse. The
+# dense kernels would have to densify every row, so both names map to the
+# kernel that works on the nonzero entries directly.
+SPARSE_ENGINES = {
+    'reference': SparseKernel,
+    'inplace': SparseKernel,
+    'scaled': ScaledKernel,
+    'lazy': LazyAverageKernel,
+}
+
+
+def make_kernel(engine, feature_matrix, initial=None):
+    """
+    Returns a new training kernel for the given engine name, picking the
+    sparse variant when feature_matrix is a scipy.sparse matrix.
+
+    Args:
+        engine - A key of ENGINES.
+        feature_matrix - The feature matrix the kernel will be trained on.
+        initial - Optional (theta, theta_0) tuple the kernel starts from
+            instead of zeros, see extended_theta. Further elements, such as
+            the update count of pegasos, are ignored.
+    """
+    engines = SPARSE_ENGINES if sparse.issparse(feature_matrix) else ENGINES
+    try:
+        kernel_class = engines[engine]
+    except KeyError:
+        raise ValueError('Unknown engine {!r}, expected one of {}.'.format(
+            engine, sorted(engines))) from None
+    kernel = kernel_class(feature_matrix.shape[1])
+    if initial is not None:
+        kernel.start_from(*initial[:2])
+    return kernel
+
+
+# Out-of-core training
+#
+# The streaming trainers take a function returning an iterable of
+# featurized chunks (feature_matrix, labels), called once per epoch, so the
+# full data set never has to be in memory. They use the same kernels and the
+# same learning rate schedule as the trainers above.
+
+
+def prefetch_chunks(chunks, depth):
+    """
+    Reads up to depth chunks ahead of the consumer in a background thread,
+    so loading and featurizing the next chunks overlaps with training on the
+    current one. Exceptions raised while reading are re-raised to the
+    consumer.
+    """
+    chunk_queue = queue.Queue(maxsize=depth)
+    end = object()
+
+    def read():
+        try:
+            for chunk in chunks:
+                chunk_queue.put(chunk)
+        except BaseException as error:
+            chunk_queue.put(error)
+        else:
+            chunk_queue.put(end)
+
+    threading.Thread(target=read, daemon=True).start()
+    while True:
+        chunk = chunk_queue.get()
+        if chunk is end:
+            return
+        if isinstance(chunk, BaseException):
+            raise chunk
+        yield chunk
+
+
+class SampleStream:
+    """
+    Iterates over the samples of a stream of featurized chunks, shuffled in a
+    bounded buffer, and owns the kernel the streaming trainers update. The
+    kernel is created from the first chunk, which decides between the dense
+    and the sparse kernels.
+
+    Args:
+        make_chunks - A function without arguments returning an iterable of
+            (feature_matrix, labels) tuples, e.g. utils.iter_featurized_chunks.
+        engine - The name of the training kernel to use, see ENGINES.
+        buffer_size - The number of samples held in the shuffle buffer. A
+            sample is only emitted once the buffer is full, at a random
+            position of it. 1 keeps the order of the stream.
+        seed - The seed of the shuffle buffer.
+        prefetch - The number of chunks read ahead by prefetch_chunks, 0 to
+            read them in the training thread.
+    """
+
+    def __init__(self, make_chunks, engine='reference', buffer_size=10000,
+                 seed=1, prefetch=0):
+        self.make_chunks = make_chunks
+        self.engine = engine
+        self.buffer_size = buffer_size
+        self.prefetch = prefetch
+        self.kernel = None
+        self.count = 0
+        self._random = random.Random(seed)
+
+    def epoch(self):
+        """Returns an iterator over the (row, label) samples of one epoch."""
+        chunks = self.make_chunks()
+        if self.prefetch:
+            chunks = prefetch_chunks(chunks, self.prefetch)
+        return self._shuffled(self._samples(chunks))
+
+    def _samples(self, chunks):
+        for feature_matrix, labels in chunks:
+            if self.kernel is None:
+                self.kernel = make_kernel(self.engine, feature_matrix)
+            rows = self.kernel.rows(feature_matrix)
+            for i, label in enumerate(label_list(labels)):
+                yield rows[i], label
+
+    def _shuffled(self, samples):
+        buffer = []
+        randrange = self._random.randrange
+        for sample in samples:
+            if len(buffer) < self.buffer_size:
+                buffer.append(sample)
+                continue
+            j = randrange(self.buffer_size)
+            self.count += 1
+            yield buffer[j]
+            buffer[j] = sample
+        self._random.shuffle(buffer)
+        for sample in buffer:
+            self.count += 1
+            yield sample
+        if self.kernel is None:
+            raise ValueError('The chunk stream is empty.')
+
+
+def perceptron_stream(make_chunks, T, engine='reference', buffer_size=10000,
+                      seed=1, prefetch=0):
+    """
+    Runs the perceptron algorithm for T epochs over a stream of featurized
+    chunks. See SampleStream for the arguments.
+
+    Returns: A tuple (theta, theta_0) as perceptron does.
+    """
+    stream = SampleStream(make_chunks, engine, buffer_size, seed, prefetch)
+    for t in range(T):
+        for row, label in stream.epoch():
+            stream.kernel.perceptron_step(row, label)
+    return (stream.kernel.theta, stream.kernel.theta_0)
+
+
+def average_perceptron_stream(make_chunks, T, engine='reference',
+                              buffer_size=10000, seed=1, prefetch=0):
+    """
+    Runs the average perceptron algorithm for T epochs over a stream of
+    featurized chunks. See SampleStream for the arguments.
+
+    Returns: A tuple (theta, theta_0) as average_perceptron does.
+    """
+    stream = SampleStream(make_chunks, engine, buffer_size, seed, prefetch)
+    for t in range(T):
+        for row, label in stream.epoch():
+            stream.kernel.perceptron_step(row, label)
+            stream.kernel.accumulate()
+    return stream.kernel.average(stream.count)
+
+
+def pegasos_stream(make_chunks, T, L, engine='reference', buffer_size=10000,
+                   seed=1, prefetch=0):
+    """
+    Runs the Pegasos algorithm for T epochs over a stream of featurized
+    chunks, with learning rate 1/sqrt(t) where t counts the updates over all
+    epochs. See SampleStream for the other arguments.
+
+    Returns: A tuple (theta, theta_0) as pegasos does.
+    """
+    stream = SampleStream(make_chunks, engine, buffer_size, seed, prefetch)
+    updates = 0
+    for t in range(T):
+        for row, label in stream.epoch():
             updates = updates + 1
             eta = 1 / np.sqrt(updates)
-            theta, theta_0 = pegasos_single_step_update(feature_matrix[i], labels[i], L, eta, theta, theta_0)
-    return (theta, theta_0)
-#pragma: coderesponse end
+            stream.kernel.pegasos_step(row, label, L, eta)
+    return (stream.kernel.theta, stream.kernel.theta_0)
+
+# Multiclass training
+#
+# The multiclass trainers keep one row of weights per class in a (k, d)
+# matrix and score every class of a sample with a single matrix-vector
+# product. A sample whose true class does not beat the best other class by
+# the required margin moves the true row towards it and that competing row
+# away from it, so one pass over the data trains all k classes together.
+
+
+def class_indices(labels, classes=None):
+    """
+    Returns the tuple (classes, indices) where classes is the sorted numpy
+    array of class labels and indices is the list of the position of every
+    label in classes.
+
+    Args:
+        labels - A numpy array with the class label of every sample.
+        classes - Optional sequence of all the class labels, for when some
+            class does not occur in labels. Defaults to np.unique(labels).
+    """
+    labels = np.asarray(labels)
+    classes = np.unique(labels if classes is None else np.asarray(classes))
+    if not np.isin(labels, classes).all():
+        raise ValueError('Every label must be one of the classes {}.'.format(classes.tolist()))
+    return classes, np.searchsorted(classes, labels).tolist()
+
+
+class MulticlassKernel:
+    """
+    Training state of the multiclass trainers: theta is a (k, d) numpy array
+    with the weights of each class and theta_0 a length-k numpy array with
+    their offsets. Samples are (column indices, values) pairs from SparseRows
+    or DenseRows, so the updates only touch the nonzero columns of CSR input.
+
+    Args:
+        num_classes - The number of classes k.
+        num_features - The number of columns d of the feature matrix.
+    """
+
+    def __init__(self, num_classes, num_features):
+        self.theta = np.zeros((num_classes, num_features))
+        self.theta_0 = np.zeros(num_classes)
+
+    def rows(self, feature_matrix):
+        if sparse.issparse(feature_matrix):
+            return SparseRows(feature_matrix)
+        return DenseRows(feature_matrix)
+
+    def rival(self, row, label):
+        """
+        Returns the tuple (margin, rival) where rival is the best scoring
+        class other than label and margin is by how much label beats it.
+        """
+        indices, values = row
+        scores = self.theta[:, indices] @ values + self.theta_0
+        true_score = scores[label]
+        scores[label] = -np.inf
+        rival = int(np.argmax(scores))
+        return true_score - scores[rival], rival
+
+    def _move(self, indices, values, label, rival, step):
+        self.theta[label, indices] += step * values
+        self.theta[rival, indices] -= step * values
+        self.theta_0[label] += step
+        self.theta_0[rival] -= step
+
+    def perceptron_step(self, row, label):
+        margin, rival = self.rival(row, label)
+        if margin <= 0:
+            self._move(row[0], row[1], label, rival, 1)
+            return True
+        return False
+
+    def pegasos_step(self, row, label, L, eta):
+        margin, rival = self.rival(row, label)
+        np.multiply(self.theta, 1 - eta * L, out=self.theta)
+        if margin <= 1:
+            self._move(row[0], row[1], label, rival, eta)
+            return True
+        return False
+
+
+def multiclass_perceptron(feature_matrix, labels, T, classes=None, sampler=None):
+    """
+    Runs the multiclass perceptron algorithm on a given set of data for T
+    iterations through the data set.
+
+    Args:
+        feature_matrix - A numpy matrix or scipy.sparse CSR matrix describing
+            the given data. Each row represents a single data point.
+        labels - A numpy array with the class label of every row of the
+            feature matrix, e.g. star ratings.
+        T - An integer indicating how many times the algorithm should
+            iterate through the feature matrix.
+        classes - Optional sequence of all the class labels, see
+            class_indices. Row j of theta belongs to the j-th smallest class.
+        sampler - Optional sampling.Sampler providing the order of the
+            samples of each epoch. Defaults to the order of get_order.
+
+    Returns: A tuple where the first element is a (k, d) numpy array with the
+    theta of every class and the second element is a length-k numpy array
+    with their theta_0.
+    """
+    classes, targets = class_indices(labels, classes)
+    kernel = MulticlassKernel(len(classes), feature_matrix.shape[1])
+    rows = kernel.rows(feature_matrix)
+    sampler = sampler or sampling.DEFAULT_SAMPLER
+    for t in range(T):
+        for i in sampler.order(feature_matrix.shape[0], t, labels).tolist():
+            kernel.perceptron_step(rows[i], targets[i])
+    return (kernel.theta, kernel.theta_0)
+
+
+def multiclass_pegasos(feature_matrix, labels, T, L, classes=None, sampler=None):
+    """
+    Runs the multiclass Pegasos algorithm on a given set of data for T
+    iterations through the data set, with the learning rate 1/sqrt(t) of
+    pegasos.
+
+    Args:
+        feature_matrix - A numpy matrix or scipy.sparse CSR matrix describing
+            the given data. Each row represents a single data point.
+        labels - A numpy array with the class label of every row of the
+            feature matrix, e.g. star ratings.
+        T - An integer indicating how many times the algorithm should
+            iterate through the feature matrix.
+        L - The lamba value being used to update the parameters.
+        classes - Optional sequence of all the class labels, see
+            class_indices. Row j of theta belongs to the j-th smallest class.
+        sampler - Optional sampling.Sampler providing the order of the
+            samples of each epoch. Defaults to the order of get_order.
+
+    Returns: A tuple where the first element is a (k, d) numpy array with the
+    theta of every class and the second element is a length-k numpy array
+    with their theta_0.
+    """
+    classes, targets = class_indices(labels, classes)
+    kernel = MulticlassKernel(len(classes), feature_matrix.shape[1])
+    rows = kernel.rows(feature_matrix)
+    sampler = sampler or sampling.DEFAULT_SAMPLER
+    updates = 0
+    for t in range(T):
+        for i in sampler.order(feature_matrix.shape[0], t, labels).tolist():
+            updates = updates + 1
+            eta = 1 / np.sqrt(updates)
+            kernel.pegasos_step(rows[i], targets[i], L, eta)
+    return (kernel.theta, kernel.theta_0)
+
+
+def classify_multiclass(feature_matrix, theta, theta_0, classes=None):
+    """
+    Classifies a set of data points with the weights of a multiclass trainer.
+
+    Args:
+        feature_matrix - A numpy matrix or scipy.sparse CSR matrix describing
+            the given data. Each row represents a single data point.
+        theta - A (k, d) numpy array with the theta of every class.
+        theta_0 - A length-k numpy array with the theta_0 of every class.
+        classes - Optional sequence of the class labels given to the trainer.
+
+    Returns: A numpy array with the class of the highest scoring row of theta
+    for every row of the feature matrix, as a label of classes when given
+    and as a row index of theta otherwise. Ties go to the smallest class.
+    """
+    scores = feature_matrix @ theta.T + theta_0
+    predictions = np.argmax(scores, axis=1)
+    if classes is None:
+        return predictions
+    return np.unique(np.asarray(classes))[predictions]
+
+# Kernel perceptron
+#
+# The kernel perceptron never forms theta. It keeps how many mistakes were
+# made on every training sample (the dual coefficients alpha) and scores a
+# point by the kernel values between it and the samples with alpha > 0.
+# During training the row of Gram matrix values of a sample is needed again
+# every epoch, so computed rows are kept in an LRU cache of bounded size.
+
+
+def gram_product(X, Y):
+    """Returns X @ Y.T as a dense numpy array, for dense or sparse X and Y."""
+    product = X @ Y.T
+    if sparse.issparse(product):
+        return product.toarray()
+    return np.asarray(product)
+
+
+def squared_norms(X):
+    """Returns the numpy array of the squared norm of every row of X."""
+    if sparse.issparse(X):
+        return np.asarray(X.multiply(X).sum(axis=1)).ravel()
+    return np.einsum('ij,ij->i', X, X)
+
+
+def polynomial_kernel(X, Y, degree=2, c=1):
+    """
+    Returns the matrix of (x . y + c) ** degree for every row x of X and y
+    of Y. degree=1 and c=0 give the linear perceptron.
+    """
+    return (gram_product(X, Y) + c) ** degree
+
+
+def rbf_kernel(X, Y, gamma=1):
+    """
+    Returns the matrix of exp(-gamma * ||x - y||^2) for every row x of X and
+    y of Y.
+    """
+    distances = squared_norms(X)[:, None] + squared_norms(Y)[None, :] - 2 * gram_product(X, Y)
+    return np.exp(-gamma * np.maximum(distances, 0))
+
+
+KERNELS = {
+    'polynomial': polynomial_kernel,
+    'rbf': rbf_kernel,
+}
+
+
+def kernel_function(kernel, kernel_params=None):
+    """
+    Returns the function computing the kernel matrix of two matrices.
+
+    Args:
+        kernel - A key of KERNELS or a function f(X, Y) returning the matrix
+            of kernel values between the rows of X and Y.
+        kernel_params - Optional dict of keyword arguments of the kernel,
+            e.g. {'degree': 3} or {'gamma': 0.1}.
+    """
+    if not callable(kernel):
+        try:
+            kernel = KERNELS[kernel]
+        except KeyError:
+            raise ValueError('Unknown kernel {!r}, expected one of {}.'.format(
+                kernel, sorted(KERNELS))) from None
+    params = kernel_params or {}
+    return lambda X, Y: kernel(X, Y, **params)
+
+
+class GramCache:
+    """
+    Rows of the Gram matrix of a feature matrix, computed on demand and kept
+    in least recently used order within a memory budget.
+
+    Args:
+        feature_matrix - A numpy matrix or scipy.sparse CSR matrix.
+        kernel - A function f(X, Y) returning the matrix of kernel values.
+        max_bytes - The memory budget of the cached rows. At least one row
+            is always cached.
+    """
+
+    def __init__(self, feature_matrix, kernel, max_bytes=64 * 2**20):
+        if sparse.issparse(feature_matrix):
+            feature_matrix = sparse.csr_matrix(feature_matrix)
+        self.feature_matrix = feature_matrix
+        self.kernel = kernel
+        n = feature_matrix.shape[0]
+        self.capacity = max(1, max_bytes // max(1, 8 * n))
+        self.hits = 0
+        self.misses = 0
+        self._rows = OrderedDict()
+
+    def __getitem__(self, i):
+        row = self._rows.get(i)
+        if row is not None:
+            self._rows.move_to_end(i)
+            self.hits += 1
+            return row
+        self.misses += 1
+        row = self.kernel(self.feature_matrix[i:i + 1], self.feature_matrix)[0]
+        if len(self._rows) >= self.capacity:
+            self._rows.popitem(last=False)
+        self._rows[i] = row
+        return row
+
+
+def kernel_perceptron(feature_matrix, labels, T, kernel='polynomial',
+                      kernel_params=None, cache_bytes=64 * 2**20, sampler=None):
+    """
+    Runs the kernel perceptron algorithm on a given set of data for T
+    iterations through the data set, in the sample order of perceptron.
+
+    Args:
+        feature_matrix - A numpy matrix or scipy.sparse CSR matrix describing
+            the given data. Each row represents a single data point.
+        labels - A numpy array where the kth element of the array is the
+            correct classification of the kth row of the feature matrix.
+        T - An integer indicating how many times the algorithm should
+            iterate through the feature matrix.
+        kernel - A key of KERNELS or a kernel function, see kernel_function.
+        kernel_params - Optional dict of keyword arguments of the kernel.
+        cache_bytes - The memory budget of the GramCache.
+        sampler - Optional sampling.Sampler providing the order of the
+            samples of each epoch. Defaults to the order of get_order.
+
+    Returns: A tuple where the first element is a numpy array with the number
+    of mistakes alpha made on every sample and the second element is a real
+    number with the value of theta_0. Samples with alpha > 0 are the support
+    vectors used by kernel_classify.
+    """
+    gram = GramCache(feature_matrix, kernel_function(kernel, kernel_params), cache_bytes)
+    label_values = label_list(labels)
+    alpha = np.zeros(feature_matrix.shape[0], dtype=np.int64)
+    # alpha * labels, kept up to date so a margin is a single dot product
+    coefficients = np.zeros(feature_matrix.shape[0])
+    theta_0 = 0
+    sampler = sampler or sampling.DEFAULT_SAMPLER
+    for t in range(T):
+        for i in sampler.order(feature_matrix.shape[0], t, labels).tolist():
+            label = label_values[i]
+            if label * (gram[i] @ coefficients + theta_0) <= 0:
+                alpha[i] += 1
+                coefficients[i] += label
+                theta_0 = theta_0 + label
+    return (alpha, theta_0)
+
+
+def kernel_classify(feature_matrix, train_matrix, train_labels, alpha, theta_0,
+                    kernel='polynomial', kernel_params=None):
+    """
+    Classifies a set of data points with the result of kernel_perceptron.
+    Only the training samples with alpha > 0 are used.
+
+    Args:
+        feature_matrix - A numpy matrix or scipy.sparse CSR matrix with the
+            data points to classify.
+        train_matrix - The feature matrix kernel_perceptron was trained on.
+        train_labels - The labels kernel_perceptron was trained on.
+        alpha - The dual coefficients returned by kernel_perceptron.
+        theta_0 - The offset returned by kernel_perceptron.
+        kernel, kernel_params - The kernel kernel_perceptron was trained with.
+
+    Returns: A numpy array of 1s and -1s with the predicted classification of
+    every row of the feature matrix, as classify.
+    """
+    support = np.flatnonzero(alpha)
+    coefficients = np.asarray(alpha)[support] * np.asarray(train_labels)[support]
+    if sparse.issparse(train_matrix):
+        train_matrix = sparse.csr_matrix(train_matrix)
+    kernel = kernel_function(kernel, kernel_params)
+    y_hat = kernel(feature_matrix, train_matrix[support]) @ coefficients + theta_0
+    return np.where(y_hat > 0, 1, -1)
+
 
 # Part II
 
@@ -274,8 +1540,8 @@ def classify(feature_matrix, theta, theta_0):
     data points.
 
     Args:
-        feature_matrix - A numpy matrix describing the given data. Each row
-            represents a single data point.
+        feature_matrix - A numpy matrix or scipy.sparse CSR matrix describing
+            the given data. Each row represents a single data point.
                 theta - A numpy array describing the linear classifier.
         theta - A numpy array describing the linear classifier.
         theta_0 - A real valued number representing the offset parameter.
@@ -307,10 +1573,12 @@ def classifier_accuracy(
     Args:
         classifier - A classifier function that takes arguments
             (feature matrix, labels, **kwargs) and returns (theta, theta_0)
-        train_feature_matrix - A numpy matrix describing the training
-            data. Each row represents a single data point.
-        val_feature_matrix - A numpy matrix describing the training
-            data. Each row represents a single data point.
+        train_feature_matrix - A numpy matrix or scipy.sparse CSR matrix
+            describing the training data. Each row represents a single data
+            point.
+        val_feature_matrix - A numpy matrix or scipy.sparse CSR matrix
+            describing the training data. Each row represents a single data
+            point.
         train_labels - A numpy array where the kth element of the array
             is the correct classification of the kth row of the training
             feature matrix.
@@ -326,16 +1594,96 @@ def classifier_accuracy(
     """
     # Your code here
     theta, theta_0 = classifier(train_feature_matrix, train_labels, **kwargs)
-    train_preds = classify(train_feature_matrix, theta, theta_0)
-    val_preds = classify(val_feature_matrix, theta, theta_0)
-    
-    train_accuracy = accuracy(train_preds, train_labels)
-    val_accuracy = accuracy(val_preds, val_labels)
-    
+    train_accuracy = evaluate(train_feature_matrix, train_labels, theta, theta_0)['accuracy']
+    val_accuracy = evaluate(val_feature_matrix, val_labels, theta, theta_0)['accuracy']
+
     return (train_accuracy, val_accuracy, theta, theta_0)
 #pragma: coderesponse end
 
 
+# Chunked evaluation
+#
+# evaluate computes every metric of a classifier from a single pass over the
+# rows of the feature matrix. The margins theta . x + theta_0 of one block of
+# rows at a time are computed once and reduced into running totals, so the
+# memory used is bounded by the block size whatever the number of rows, and
+# a memory-mapped matrix is only read block by block.
+
+# Default bin edges of the histogram of the margins label * (theta . x + theta_0)
+MARGIN_HISTOGRAM_EDGES = np.linspace(-5, 5, 21)
+
+
+def row_blocks(feature_matrix, block_size):
+    """
+    Yields the tuples (start, block) of consecutive blocks of at most
+    block_size rows of a numpy matrix, memmap or scipy.sparse CSR matrix.
+    """
+    if sparse.issparse(feature_matrix):
+        feature_matrix = sparse.csr_matrix(feature_matrix)
+    for start in range(0, feature_matrix.shape[0], block_size):
+        yield start, feature_matrix[start:start + block_size]
+
+
+def evaluate(feature_matrix, labels, theta, theta_0, block_size=10000,
+             histogram_edges=MARGIN_HISTOGRAM_EDGES):
+    """
+    Evaluates a linear classifier on a set of data in one pass.
+
+    Args:
+        feature_matrix - A numpy matrix, memmap or scipy.sparse CSR matrix
+            describing the given data. Each row represents a single data point.
+        labels - A numpy array where the kth element of the array is the
+            correct classification (1 or -1) of the kth row of the feature
+            matrix.
+        theta - A numpy array describing the linear classifier.
+        theta_0 - A real valued number representing the offset parameter.
+        block_size - The number of rows whose margins are computed at once.
+        histogram_edges - The increasing bin edges of the margin histogram.
+            Margins outside the edges are counted in the outer bins.
+
+    Returns: A dict with
+        'hinge_loss' - The value hinge_loss_full would return.
+        'accuracy' - The accuracy of the predictions of classify.
+        'confusion' - The 2x2 numpy array of counts whose rows are the true
+            labels -1 and 1 and whose columns are the predicted labels -1
+            and 1.
+        'margin_histogram' - The numpy array of counts of the margins
+            label * (theta . x + theta_0) in every bin of histogram_edges.
+    """
+    histogram_edges = np.asarray(histogram_edges, dtype=float)
+    n = feature_matrix.shape[0]
+    hinge_sum = 0.0
+    confusion = np.zeros((2, 2), dtype=np.int64)
+    histogram = np.zeros(len(histogram_edges) - 1, dtype=np.int64)
+    for start, block in row_blocks(feature_matrix, block_size):
+        block_labels = np.asarray(labels[start:start + block.shape[0]], dtype=float)
+        scores = block @ theta + theta_0
+        margins = block_labels * scores
+        hinge_sum += np.maximum(0, 1 - margins).sum()
+        confusion += np.bincount(2 * (block_labels > 0) + (scores > 0),
+                                 minlength=4).reshape(2, 2)
+        clipped = np.clip(margins, histogram_edges[0], histogram_edges[-1])
+        histogram += np.histogram(clipped, histogram_edges)[0]
+    return {
+        'hinge_loss': hinge_sum / n if n else float('nan'),
+        'accuracy': np.trace(confusion) / n if n else float('nan'),
+        'confusion': confusion,
+        'margin_histogram': histogram,
+    }
+
+
+# A word is either a single punctuation character or digit, or a run of
+# characters that are neither whitespace nor one of those symbols. This gives
+# the same tokens as surrounding every symbol with spaces and splitting on
+# whitespace, in a single pass over the string.
+WORD_PATTERN = re.compile('[{0}]|[^\\s{0}]+'.format(re.escape(punctuation + digits)))
+
+# str.lower() maps a capital sigma depending on the letters around it, so
+# texts containing one are lowercased after the symbols have been separated,
+# as the words would be with the spaces in place.
+CONTEXT_LOWER = '\u03a3'
+
+
 #pragma: coderesponse template
 def extract_words(input_string):
     """
@@ -344,22 +1692,36 @@ def extract_words(input_string):
     Returns a list of lowercase words in the string.
     Punctuation and digits are separated out into their own words.
     """
-    for c in punctuation + digits:
-        input_string = input_string.replace(c, ' ' + c + ' ')
-
-    return input_string.lower().split()
+    if CONTEXT_LOWER in input_string:
+        return ' '.join(WORD_PATTERN.findall(input_string)).lower().split()
+    return WORD_PATTERN.findall(input_string.lower())
 #pragma: coderesponse end
 
 
+def extract_words_batch(texts):
+    """
+    Inputs a list of text strings
+    Returns the list of extract_words() of every string, looking up the
+    compiled pattern once for the whole corpus.
+    """
+    findall = WORD_PATTERN.findall
+    return [
+        ' '.join(findall(text)).lower().split() if CONTEXT_LOWER in text
+        else findall(text.lower())
+        for text in texts]
+
+
 #pragma: coderesponse template
-def bag_of_words(texts, ignore_words):
+def bag_of_words(texts, ignore_words=()):
     """
     Inputs a list of string reviews
+    Inputs the words to leave out of the dictionary, e.g. stopwords
     Returns a dictionary of unique unigrams occurring over the input
 
     Feel free to change this code as guided by Problem 9
     """
     # Your code here
+    ignore_words = frozenset(ignore_words)
     dictionary = {} # maps word to unique index
     for text in texts:
         word_list = extract_words(text)
@@ -372,30 +1734,457 @@ def bag_of_words(texts, ignore_words):
 
 
 #pragma: coderesponse template
-def extract_bow_feature_vectors(reviews, dictionary):
+def extract_bow_feature_vectors(reviews, dictionary, sparse_output=False):
     """
     Inputs a list of string reviews
     Inputs the dictionary of words as given by bag_of_words
     Returns the bag-of-words feature matrix representation of the data.
     The returned matrix is of shape (n, m), where n is the number of reviews
     and m the total number of entries in the dictionary.
+    If sparse_output is True the matrix is returned as a scipy.sparse CSR
+    matrix holding only the nonzero counts.
 
     Feel free to change this code as guided by Problem 9
     """
     # Your code here
+    if sparse_output:
+        return count_matrix(map(extract_words, reviews), dictionary)
 
     num_reviews = len(reviews)
     feature_matrix = np.zeros([num_reviews, len(dictionary)])
 
     for i, text in enumerate(reviews):
-        word_list = extract_words(text)
-        for word in word_list:
+        for word, count in Counter(extract_words(text)).items():
             if word in dictionary:
-                feature_matrix[i, dictionary[word]] = word_list.count(word)
+                feature_matrix[i, dictionary[word]] = count
     return feature_matrix
 #pragma: coderesponse end
 
 
+def csr_index_dtype(nnz, shape):
+    """
+    Returns the dtype scipy.sparse keeps for the indices and indptr of a CSR
+    matrix with nnz entries and the given shape: int32 when every index fits
+    in it, int64 otherwise. Building the arrays in that dtype saves the copy
+    scipy makes to downcast them.
+    """
+    if max(nnz, *shape) < 2**31:
+        return np.int32
+    return np.int64
+
+
+def count_matrix(word_lists, dictionary, ignore_words=None):
+    """
+    Builds the CSR matrix of word counts of an iterable of word lists, as
+    returned by extract_words, directly from the per-document counts.
+
+    Args:
+        word_lists - An iterable with the list of words of every document,
+            or with a Counter of them.
+        dictionary - The dictionary mapping words to column indices.
+        ignore_words - If None, words missing from dictionary are skipped.
+            Otherwise they are added to dictionary in order of first
+            occurrence, as bag_of_words does, unless they are in this set.
+
+    Returns: A scipy.sparse CSR matrix of shape (n, len(dictionary)) with
+    sorted column indices.
+    """
+    indptr = [0]
+    indices = []
+    data = []
+    for words in word_lists:
+        for word, count in Counter(words).items():
+            index = dictionary.get(word)
+            if index is None:
+                if ignore_words is None or word in ignore_words:
+                    continue
+                index = dictionary[word] = len(dictionary)
+            indices.append(index)
+            data.append(count)
+        indptr.append(len(indices))
+    shape = (len(indptr) - 1, len(dictionary))
+    index_dtype = csr_index_dtype(len(indices), shape)
+    feature_matrix = sparse.csr_matrix(
+        (np.array(data, dtype=np.float64),
+         np.array(indices, dtype=index_dtype),
+         np.array(indptr, dtype=index_dtype)),
+        shape=shape, copy=False)
+    feature_matrix.sort_indices()
+    return feature_matrix
+
+
+# Parallel featurization
+#
+# The texts are split into contiguous shards that worker processes tokenize
+# and count on their own, each with a local dictionary in order of first
+# occurrence. Merging the local dictionaries in shard order gives every word
+# the index it gets from the serial run, and the local column indices of each
+# shard are translated into a single preallocated CSR matrix.
+
+
+def text_shards(texts, n_jobs):
+    """
+    Splits texts into contiguous lists, about four per job so that shards of
+    uneven cost are balanced between the processes.
+    """
+    texts = list(texts)
+    size = max(1, -(-len(texts) // (4 * n_jobs)))
+    return [texts[start:start + size] for start in range(0, len(texts), size)]
+
+
+def shard_vocabulary(texts, ignore_words):
+    """Returns the list of words of texts in order of first occurrence."""
+    words = {}
+    for text_words in extract_words_batch(texts):
+        for word in text_words:
+            if word not in words and word not in ignore_words:
+                words[word] = None
+    return list(words)
+
+
+def shard_counts(texts, ignore_words):
+    """
+    Returns the tuple (words, indptr, indices, data) of the word count CSR
+    matrix of texts over their own dictionary, whose words are listed in
+    index order.
+    """
+    dictionary = {}
+    feature_matrix = count_matrix(extract_words_batch(texts), dictionary, ignore_words)
+    return list(dictionary), feature_matrix.indptr, feature_matrix.indices, feature_matrix.data
+
+
+def map_shards(function, texts, ignore_words, n_jobs):
+    """
+    Returns the list of the results of function(shard, ignore_words) for the
+    shards of texts, in shard order, computed by n_jobs processes.
+    """
+    shards = text_shards(texts, n_jobs)
+    if n_jobs == 1 or len(shards) <= 1:
+        return [function(shard, ignore_words) for shard in shards]
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        return list(pool.map(function, shards, [ignore_words] * len(shards)))
+
+
+def merge_vocabulary(words, dictionary, grow):
+    """
+    Returns the int64 numpy array of the index in dictionary of every word of
+    words. Missing words are added to dictionary when grow is True and get -1
+    otherwise.
+    """
+    indices = np.empty(len(words), dtype=np.int64)
+    for j, word in enumerate(words):
+        index = dictionary.get(word)
+        if index is None:
+            if grow:
+                index = dictionary[word] = len(dictionary)
+            else:
+                index = -1
+        indices[j] = index
+    return indices
+
+
+def parallel_bag_of_words(texts, ignore_words=(), n_jobs=None):
+    """
+    Returns the dictionary of bag_of_words(texts, ignore_words), with the
+    texts tokenized by n_jobs processes (all the CPUs by default).
+    """
+    n_jobs = n_jobs or os.cpu_count()
+    dictionary = {}
+    for words in map_shards(shard_vocabulary, texts, frozenset(ignore_words), n_jobs):
+        merge_vocabulary(words, dictionary, grow=True)
+    return dictionary
+
+
+def parallel_count_matrix(texts, dictionary, ignore_words=None, n_jobs=None):
+    """
+    Parallel version of count_matrix(map(extract_words, texts), dictionary,
+    ignore_words) giving the same dictionary and the same matrix.
+
+    Args:
+        texts - A list of review texts.
+        dictionary - The dictionary mapping words to column indices.
+        ignore_words - If None, words missing from dictionary are skipped.
+            Otherwise they are added to dictionary in order of first
+            occurrence, unless they are in this set.
+        n_jobs - The number of processes, all the CPUs by default.
+
+    Returns: A scipy.sparse CSR matrix of shape (n, len(dictionary)) with
+    sorted column indices.
+    """
+    n_jobs = n_jobs or os.cpu_count()
+    grow = ignore_words is not None
+    shards = map_shards(shard_counts, texts, frozenset(ignore_words or ()), n_jobs)
+
+    blocks = []
+    for words, indptr, indices, data in shards:
+        columns = merge_vocabulary(words, dictionary, grow)[indices]
+        if not grow:
+            kept = columns >= 0
+            indptr = np.concatenate(([0], np.cumsum(kept)))[indptr]
+            columns, data = columns[kept], data[kept]
+        blocks.append((indptr, columns, data))
+
+    n_rows = sum(len(indptr) - 1 for indptr, _, _ in blocks)
+    nnz = sum(len(data) for _, _, data in blocks)
+    index_dtype = csr_index_dtype(nnz, (n_rows, len(dictionary)))
+    indptr = np.zeros(n_rows + 1, dtype=index_dtype)
+    indices = np.empty(nnz, dtype=index_dtype)
+    data = np.empty(nnz)
+    row = nnz_start = 0
+    for block_indptr, block_indices, block_data in blocks:
+        rows = len(block_indptr) - 1
+        nnz_end = nnz_start + len(block_data)
+        indptr[row + 1:row + rows + 1] = block_indptr[1:] + nnz_start
+        indices[nnz_start:nnz_end] = block_indices
+        data[nnz_start:nnz_end] = block_data
+        row, nnz_start = row + rows, nnz_end
+    feature_matrix = sparse.csr_matrix(
+        (data, indices, indptr), shape=(n_rows, len(dictionary)), copy=False)
+    feature_matrix.sort_indices()
+    return feature_matrix
+
+
+class BagOfWordsVectorizer:
+    """
+    Builds the dictionary of bag_of_words and the feature matrix of
+    extract_bow_feature_vectors from a single tokenization pass, counting
+    the words of every review with a Counter.
+
+    Args:
+        ignore_words - The words to leave out of the dictionary, e.g.
+            stopwords. Kept as a frozenset.
+        sparse_output - If True the feature matrices are returned as
+            scipy.sparse CSR matrices, otherwise as dense numpy arrays.
+        n_jobs - The number of processes tokenizing the texts. With more
+            than one, the texts are featurized by parallel_bag_of_words and
+            parallel_count_matrix, with the same results.
+    """
+
+    def __init__(self, ignore_words=(), sparse_output=False, n_jobs=1):
+        self.ignore_words = frozenset(ignore_words)
+        self.sparse_output = sparse_output
+        self.n_jobs = n_jobs
+        self.dictionary = None
+
+    def fit(self, texts):
+        """Builds the dictionary from texts and returns the vectorizer."""
+        if self.n_jobs != 1:
+            self.dictionary = parallel_bag_of_words(texts, self.ignore_words, self.n_jobs)
+        else:
+            self.dictionary = bag_of_words(texts, self.ignore_words)
+        return self
+
+    def fit_transform(self, texts):
+        """
+        Builds the dictionary from texts and returns their feature matrix,
+        tokenizing every text once.
+        """
+        self.dictionary = {}
+        return self._output(self._count(texts, self.ignore_words))
+
+    def transform(self, texts):
+        """
+        Returns the feature matrix of texts over the fitted dictionary. Words
+        that are not in the dictionary are dropped.
+        """
+        if self.dictionary is None:
+            raise ValueError('The vectorizer has to be fitted before transform.')
+        return self._output(self._count(texts, None))
+
+    def partial_fit_transform(self, texts):
+        """
+        Returns the feature matrix of texts, appending their new words to the
+        dictionary instead of dropping them. Known words keep their indices,
+        so a theta trained on earlier texts remains valid once extended with
+        zero weights, see GrowableTheta and the initial argument of the
+        trainers.
+        """
+        if self.dictionary is None:
+            self.dictionary = {}
+        return self._output(self._count(texts, self.ignore_words))
+
+    def _count(self, texts, ignore_words):
+        if self.n_jobs != 1:
+            return parallel_count_matrix(texts, self.dictionary, ignore_words, self.n_jobs)
+        return count_matrix(map(extract_words, texts), self.dictionary, ignore_words)
+
+    def _output(self, feature_matrix):
+        if self.sparse_output:
+            return feature_matrix
+        return feature_matrix.toarray()
+
+
+class NgramVectorizer:
+    """
+    Bag-of-n-grams featurizer. Document frequencies are counted in a single
+    pass and the n-grams are pruned by min_df, max_df and max_features
+    before any index is assigned, so the width of the feature matrices, and
+    with it the cost of every theta update, stays bounded.
+
+    Stopwords are removed before the n-grams are formed, and the words of an
+    n-gram are joined by a space. Kept n-grams are indexed in order of first
+    occurrence, so with the defaults the dictionary equals bag_of_words.
+
+    Args:
+        ngram_range - The (min_n, max_n) lengths of the n-grams to count.
+        min_df - The minimum document frequency of a kept n-gram, as a count
+            if it is an int and as a fraction of the documents if a float.
+        max_df - The maximum document frequency, with the same convention.
+        max_features - If set, only this many n-grams with the highest
+            document frequencies are kept.
+        ignore_words - The words to leave out, e.g. stopwords.
+        sparse_output - If True the feature matrices are returned as
+            scipy.sparse CSR matrices, otherwise as dense numpy arrays.
+    """
+
+    def __init__(self, ngram_range=(1, 1), min_df=1, max_df=1.0,
+                 max_features=None, ignore_words=(), sparse_output=False):
+        self.ngram_range = ngram_range
+        self.min_df = min_df
+        self.max_df = max_df
+        self.max_features = max_features
+        self.ignore_words = frozenset(ignore_words)
+        self.sparse_output = sparse_output
+        self.dictionary = None
+        self.document_frequencies = None
+
+    def ngrams(self, text):
+        """Returns the list of n-grams of text."""
+        words = [word for word in extract_words(text) if word not in self.ignore_words]
+        min_n, max_n = self.ngram_range
+        grams = []
+        for n in range(min_n, max_n + 1):
+            if n == 1:
+                grams.extend(words)
+            else:
+                grams.extend(' '.join(words[i:i + n]) for i in range(len(words) - n + 1))
+        return grams
+
+    def fit(self, texts):
+        """Builds the pruned dictionary from texts and returns the vectorizer."""
+        self._fit(texts, keep_counts=False)
+        return self
+
+    def fit_transform(self, texts):
+        """
+        Builds the pruned dictionary from texts and returns their feature
+        matrix, extracting the n-grams of every text once.
+        """
+        counts = self._fit(texts, keep_counts=True)
+        return self._output(count_matrix(counts, self.dictionary))
+
+    def transform(self, texts):
+        """
+        Returns the feature matrix of texts over the fitted dictionary.
+        N-grams that are not in the dictionary are dropped.
+        """
+        if self.dictionary is None:
+            raise ValueError('The vectorizer has to be fitted before transform.')
+        return self._output(count_matrix(map(self.ngrams, texts), self.dictionary))
+
+    def _fit(self, texts, keep_counts):
+        frequencies = Counter()
+        counts = []
+        num_documents = 0
+        for text in texts:
+            document = Counter(self.ngrams(text))
+            frequencies.update(document.keys())
+            num_documents += 1
+            if keep_counts:
+                counts.append(document)
+
+        low = self._document_count(self.min_df, num_documents)
+        high = self._document_count(self.max_df, num_documents)
+        kept = [gram for gram, df in frequencies.items() if low <= df <= high]
+        if self.max_features is not None and len(kept) > self.max_features:
+            first = {gram: i for i, gram in enumerate(kept)}
+            kept = sorted(kept, key=lambda gram: (-frequencies[gram], first[gram]))
+            kept = sorted(kept[:self.max_features], key=first.get)
+
+        self.dictionary = {gram: i for i, gram in enumerate(kept)}
+        self.document_frequencies = np.array([frequencies[gram] for gram in kept])
+        return counts
+
+    @staticmethod
+    def _document_count(df, num_documents):
+        if isinstance(df, float):
+            return df * num_documents
+        return df
+
+    def _output(self, feature_matrix):
+        if self.sparse_output:
+            return feature_matrix
+        return feature_matrix.toarray()
+
+
+class HashingVectorizer:
+    """
+    Bag-of-words featurizer without a dictionary: every word is counted in
+    the column given by the CRC-32 of its UTF-8 encoding modulo n_buckets.
+    Nothing is fitted, so texts can be featurized chunk by chunk in constant
+    memory, and the CSR matrices it returns can be passed to perceptron,
+    pegasos and classify as they are.
+
+    Args:
+        n_buckets - The number of columns of the feature matrices, at most
+            2 ** 31.
+        signed - If True the count of a word is added with the sign given by
+            the highest bit of its hash, so collisions cancel out on average
+            instead of accumulating.
+        ignore_words - The words that are not counted, e.g. stopwords.
+    """
+
+    def __init__(self, n_buckets=2 ** 20, signed=False, ignore_words=()):
+        if not 0 < n_buckets <= 2 ** 31:
+            raise ValueError('n_buckets must be between 1 and 2 ** 31, got {}.'.format(n_buckets))
+        self.n_buckets = n_buckets
+        self.signed = signed
+        self.ignore_words = frozenset(ignore_words)
+
+    def fit(self, texts):
+        """Does nothing, hashing needs no fitting. Returns the vectorizer."""
+        return self
+
+    def fit_transform(self, texts):
+        return self.transform(texts)
+
+    def transform(self, texts):
+        """
+        Returns the scipy.sparse CSR matrix of shape (len(texts), n_buckets)
+        with the hashed word counts of texts.
+        """
+        n_buckets = self.n_buckets
+        signed = self.signed
+        ignore_words = self.ignore_words
+        crc32 = zlib.crc32
+        indptr = [0]
+        indices = []
+        data = []
+        for words in map(extract_words, texts):
+            row = {}
+            for word, count in Counter(words).items():
+                if word in ignore_words:
+                    continue
+                hashed = crc32(word.encode('utf-8'))
+                if signed and hashed >> 31:
+                    count = -count
+                bucket = hashed % n_buckets
+                row[bucket] = row.get(bucket, 0) + count
+            indices.extend(row.keys())
+            data.extend(row.values())
+            indptr.append(len(indices))
+        shape = (len(indptr) - 1, n_buckets)
+        index_dtype = csr_index_dtype(len(indices), shape)
+        feature_matrix = sparse.csr_matrix(
+            (np.array(data, dtype=np.float64),
+             np.array(indices, dtype=index_dtype),
+             np.array(indptr, dtype=index_dtype)),
+            shape=shape, copy=False)
+        feature_matrix.eliminate_zeros()
+        feature_matrix.sort_indices()
+        return feature_matrix
+
+
 #pragma: coderesponse template
 def accuracy(preds, targets):
     """
@@ -0,0 +1,178 @@
+import os
+import random
+import numpy as np
+
+# Sample orders for the trainers in project1.
+#
+# The orders are int64 numpy arrays, computed once per (n_samples, seed,
+# directory) and shared between every epoch and every call.
+
+_ORDER_CACHE = {}
+
+
+def load_order_file(path):
+    """
+    Reads a fixed sample order from disk.
+
+    Args:
+        path - Either a `<n>.txt` file holding a single comma separated line
+            of indices, or a `<n>.npy` file, which is memory-mapped instead of
+            being parsed so very large orders are not copied into memory.
+
+    Returns: An int64 numpy array (or read-only memmap) with the order.
+    """
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    with open(path) as fp:
+        line = fp.readline()
+    return np.array(line.split(','), dtype=np.int64)
+
+
+def save_order_file(path, order):
+    """
+    Writes order as a `.npy` file that load_order_file can memory-map.
+    """
+    np.save(path, np.asarray(order, dtype=np.int64))
+
+
+def cached_order(n_samples, seed=1, directory='.'):
+    """
+    Returns the base order of n_samples, memoized per (n_samples, seed,
+    directory).
+
+    The order is read from `<n_samples>.npy` or `<n_samples>.txt` in
+    directory when one of them exists, otherwise it is the shuffle of
+    range(n_samples) produced by random.seed(seed), exactly as in
+    project1.get_order. The returned array is shared and must not be
+    modified.
+    """
+    directory = os.path.abspath(directory)
+    key = (n_samples, seed, directory)
+    order = _ORDER_CACHE.get(key)
+    if order is None:
+        order = _base_order(n_samples, seed, directory)
+        _ORDER_CACHE[key] = order
+    return order
+
+
+def _base_order(n_samples, seed, directory):
+    for extension in ('.npy', '.txt'):
+        path = os.path.join(directory, str(n_samples) + extension)
+        if os.path.exists(path):
+            return load_order_file(path)
+    random.seed(seed)
+    indices = list(range(n_samples))
+    random.shuffle(indices)
+    order = np.array(indices, dtype=np.int64)
+    order.flags.writeable = False
+    return order
+
+
+def clear_cache():
+    """Forgets every memoized order, e.g. after an order file changed."""
+    _ORDER_CACHE.clear()
+
+
+def epoch_permutation(n_samples, seed, epoch):
+    """
+    Returns the permutation of range(n_samples) of the given epoch, which
+    only depends on (seed, epoch).
+    """
+    return np.random.default_rng([seed, epoch]).permutation(n_samples)
+
+
+def stratified_order(order, labels):
+    """
+    Reorders order so that every class of labels is spread evenly over the
+    epoch, while keeping the relative order of the samples of each class.
+
+    Args:
+        order - An int64 numpy array with a permutation of the samples.
+        labels - A numpy array with the label of every sample.
+
+    Returns: An int64 numpy array with the stratified permutation.
+    """
+    order = np.asarray(order, dtype=np.int64)
+    ordered_labels = np.asarray(labels)[order]
+    positions = np.empty(len(order))
+    for label in np.unique(ordered_labels):
+        members = np.flatnonzero(ordered_labels == label)
+        positions[members] = (np.arange(len(members)) + 0.5) / len(members)
+    return order[np.argsort(positions, kind='stable')]
+
+
+class Sampler:
+    """
+    Provides the order in which the trainers visit the samples of each epoch.
+
+    The default Sampler() reproduces project1.get_order: every epoch uses the
+    same order, read from `<n>.txt` when it exists and shuffled with seed 1
+    otherwise, but the order is only computed once.
+
+    Args:
+        seed - The seed of the base order and of the per-epoch orders.
+        per_epoch - If True every epoch uses its own permutation. Each one is
+            generated once, the first time an epoch at least as late is
+            requested.
+        stratified - If True each order is passed through stratified_order
+            with the labels given to order().
+        directory - Where to look for fixed order files.
+    """
+
+    def __init__(self, seed=1, per_epoch=False, stratified=False, directory='.'):
+        self.seed = seed
+        self.per_epoch = per_epoch
+        self.stratified = stratified
+        self.directory = directory
+        # n_samples -> (buffer, filled), the first filled rows of buffer
+        # holding the per-epoch orders generated so far
+        self._epoch_orders = {}
+
+    def orders(self, n_samples, T):
+        """
+        Returns a (T, n_samples) int64 array with the order of every epoch,
+        before stratification. Per-epoch orders are cached per n_samples and
+        only the epochs not generated yet are added when more are requested.
+        """
+        if not self.per_epoch:
+            return np.broadcast_to(self._base(n_samples), (T, n_samples))
+        buffer, filled = self._epoch_orders.get(n_samples, (None, 0))
+        if filled < T:
+            if buffer is None or len(buffer) < T:
+                # The capacity doubles, so requesting the epochs one by one
+                # copies O(T) rows in total. Earlier results stay valid as
+                # the previous buffer is never written again.
+                grown = np.empty((max(T, 2 * filled), n_samples), dtype=np.int64)
+                if buffer is not None:
+                    grown[:filled] = buffer[:filled]
+                buffer = grown
+            for epoch in range(filled, T):
+                buffer[epoch] = epoch_permutation(n_samples, self.seed, epoch)
+            self._epoch_orders[n_samples] = (buffer, T)
+        return buffer[:T]
+
+    def order(self, n_samples, epoch=0, labels=None):
+        """
+        Returns the order of the samples for the given epoch as an int64
+        numpy array.
+
+        Args:
+            n_samples - The number of samples.
+            epoch - The zero-based epoch number.
+            labels - The labels of the samples, required when stratified.
+        """
+        if self.per_epoch:
+            order = self.orders(n_samples, epoch + 1)[epoch]
+        else:
+            order = self._base(n_samples)
+        if self.stratified:
+            if labels is None:
+                raise ValueError('A stratified sampler needs the labels.')
+            order = stratified_order(order, labels)
+        return order
+
+    def _base(self, n_samples):
+        return cached_order(n_samples, self.seed, self.directory)
+
+
+DEFAULT_SAMPLER = Sampler()
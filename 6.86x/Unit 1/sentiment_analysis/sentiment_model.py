@@ -0,0 +1,161 @@
+import json
+import os
+import shutil
+import uuid
+from collections.abc import Mapping
+import numpy as np
+
+import project1 as p1
+
+# A saved model is a directory of memory-mapped files:
+#
+#   theta.npy    float32 weights, in the order of the sorted vocabulary
+#   words.npy    uint8 UTF-8 bytes of the sorted words, concatenated
+#   offsets.npy  int64 start of every word in words.npy, plus the total length
+#   meta.json    the format version and theta_0
+#
+# Loading only maps the arrays, so the cold start of a scorer does not depend
+# on the size of the vocabulary and processes loading the same model share
+# its pages through the page cache.
+
+FORMAT_VERSION = 1
+
+
+class StringTable(Mapping):
+    """
+    Read-only mapping from the words of a sorted string table to their
+    positions, looked up by binary search over the table.
+
+    Words found once are remembered, so repeated lookups cost a dict access
+    and the memory used grows with the words seen rather than the table.
+
+    Args:
+        data - A uint8 numpy array with the UTF-8 bytes of the sorted words.
+        offsets - An int64 numpy array with the start of every word in data,
+            followed by len(data).
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+        self._found = {}
+
+    @classmethod
+    def from_words(cls, words):
+        """Returns (table, order) for words, where order sorts words."""
+        order = sorted(range(len(words)), key=lambda i: words[i].encode())
+        encoded = [words[i].encode() for i in order]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(word) for word in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(data, offsets), np.array(order, dtype=np.int64)
+
+    def word(self, i):
+        """Returns the i-th word of the table."""
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode()
+
+    def _position(self, key):
+        start, end = 0, len(self)
+        while start < end:
+            middle = (start + end) // 2
+            if self.data[self.offsets[middle]:self.offsets[middle + 1]].tobytes() < key:
+                start = middle + 1
+            else:
+                end = middle
+        return start
+
+    def __getitem__(self, word):
+        index = self._found.get(word)
+        if index is not None:
+            return index
+        if not isinstance(word, str):
+            raise KeyError(word)
+        key = word.encode()
+        index = self._position(key)
+        if index == len(self) or self.word(index).encode() != key:
+            raise KeyError(word)
+        self._found[word] = index
+        return index
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        return (self.word(i) for i in range(len(self)))
+
+
+class SentimentModel:
+    """
+    A trained linear sentiment classifier together with the dictionary of
+    its bag-of-words features, able to score raw review texts.
+
+    Args:
+        theta - A numpy array describing the linear classifier.
+        theta_0 - A real valued number representing the offset parameter.
+        dictionary - The dictionary mapping words to the indices of theta,
+            or any mapping with a get method such as a StringTable.
+    """
+
+    def __init__(self, theta, theta_0, dictionary):
+        self.theta = theta
+        self.theta_0 = theta_0
+        self.vectorizer = p1.BagOfWordsVectorizer(sparse_output=True)
+        self.vectorizer.dictionary = dictionary
+
+    @property
+    def dictionary(self):
+        return self.vectorizer.dictionary
+
+    def margins(self, texts):
+        """Returns the numpy array of theta . x + theta_0 of every text."""
+        return self.vectorizer.transform(texts) @ self.theta + self.theta_0
+
+    def predict(self, texts):
+        """
+        Returns the tuple (labels, margins) of numpy arrays for texts, where
+        labels holds 1 for a positive margin and -1 otherwise, as classify.
+        """
+        margins = self.margins(texts)
+        return np.where(margins > 0, 1, -1), margins
+
+    def save(self, path):
+        """
+        Saves the model to the directory path, with theta stored as float32
+        and reordered to follow the sorted vocabulary. The directory is
+        written under a temporary name and renamed, replacing any previous
+        model at path. It is created with the permissions of the umask, so
+        scorers running as other users can map it.
+        """
+        words = [None] * len(self.dictionary)
+        for word, i in self.dictionary.items():
+            words[i] = word
+        table, order = StringTable.from_words(words)
+        path = os.path.abspath(path)
+        tmp = '{}.tmp-{}'.format(path, uuid.uuid4().hex)
+        os.mkdir(tmp)
+        try:
+            np.save(os.path.join(tmp, 'theta.npy'),
+                    np.asarray(self.theta, dtype=np.float32)[order])
+            np.save(os.path.join(tmp, 'words.npy'), table.data)
+            np.save(os.path.join(tmp, 'offsets.npy'), table.offsets)
+            with open(os.path.join(tmp, 'meta.json'), 'w') as fp:
+                json.dump({'version': FORMAT_VERSION,
+                           'theta_0': float(self.theta_0)}, fp)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.rename(tmp, path)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """Loads a model saved by save, memory-mapping its arrays."""
+        with open(os.path.join(path, 'meta.json')) as fp:
+            meta = json.load(fp)
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError('Unsupported model format {}.'.format(meta['version']))
+        table = StringTable(np.load(os.path.join(path, 'words.npy'), mmap_mode='r'),
+                            np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r'))
+        theta = np.load(os.path.join(path, 'theta.npy'), mmap_mode='r')
+        return cls(theta, meta['theta_0'], table)
@@ -0,0 +1,198 @@
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sentiment_model import SentimentModel
+
+# Long-running scoring process for a saved SentimentModel.
+#
+# Requests from any number of clients are queued and scored together in
+# micro-batches, so the cost of the sparse matrix product is shared and the
+# model is only loaded once at startup.
+#
+#   python serve.py model --stdio
+#       reads one review per line on stdin and writes "label<TAB>margin"
+#       lines to stdout, in the same order.
+#   python serve.py model --port 8000
+#       answers POST / with a JSON body {"texts": [...]} by
+#       {"labels": [...], "margins": [...]}.
+
+
+class MicroBatcher:
+    """
+    Collects the texts submitted by concurrent requests and scores them in
+    batches on a background thread.
+
+    A batch is scored as soon as it holds batch_size texts, or max_latency
+    seconds after its first request arrived, whichever comes first. A single
+    request is never split between batches.
+
+    Args:
+        model - The SentimentModel scoring the batches.
+        batch_size - The number of texts that triggers scoring.
+        max_latency - The longest time in seconds a request waits for other
+            requests to fill its batch.
+    """
+
+    def __init__(self, model, batch_size=256, max_latency=0.005):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self._requests = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, texts):
+        """
+        Queues texts for scoring. Returns a Future resolving to the tuple
+        (labels, margins) of lists for texts.
+        """
+        future = Future()
+        self._requests.put((list(texts), future))
+        return future
+
+    def _next_batch(self):
+        batch = [self._requests.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_latency
+        while size < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._score(batch)
+            except Exception:
+                # Score the requests one by one, so only the failing ones fail
+                for request in batch:
+                    try:
+                        self._score([request])
+                    except Exception as error:
+                        request[1].set_exception(error)
+
+    def _score(self, batch):
+        texts = [text for request_texts, _ in batch for text in request_texts]
+        labels, margins = self.model.predict(texts)
+        labels = labels.tolist()
+        margins = margins.tolist()
+        start = 0
+        for request_texts, future in batch:
+            end = start + len(request_texts)
+            future.set_result((labels[start:end], margins[start:end]))
+            start = end
+
+
+def serve_stdio(batcher, lines=sys.stdin, out=sys.stdout):
+    """
+    Scores every line of lines as one review and writes "label<TAB>margin"
+    to out, in input order. Reading is not blocked by scoring, so lines that
+    arrive together are batched together. A line that fails to be scored is
+    answered by "0<TAB>nan" and the error is reported on stderr.
+    """
+    pending = queue.Queue()
+    end = object()
+
+    def write():
+        while True:
+            future = pending.get()
+            if future is end:
+                return
+            try:
+                labels, margins = future.result()
+            except Exception as error:
+                # Keep writing the other lines, with an error line in place
+                print('Scoring failed:', error, file=sys.stderr)
+                out.write('0\tnan\n')
+            else:
+                out.write('{}\t{!r}\n'.format(labels[0], margins[0]))
+            if pending.empty():
+                out.flush()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    for line in lines:
+        pending.put(batcher.submit([line.rstrip('\n')]))
+    pending.put(end)
+    writer.join()
+    out.flush()
+
+
+def make_handler(batcher):
+    """Returns the HTTP request handler class answering with batcher."""
+
+    class PredictHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                texts = json.loads(self.rfile.read(length)).get('texts')
+                if not isinstance(texts, list) or \
+                        not all(isinstance(text, str) for text in texts):
+                    raise ValueError('The body must be {"texts": [...]} with string texts.')
+            except (ValueError, AttributeError) as error:
+                self._reply(400, {'error': str(error)})
+                return
+            try:
+                labels, margins = batcher.submit(texts).result()
+            except Exception as error:
+                self._reply(500, {'error': str(error)})
+                return
+            self._reply(200, {'labels': labels, 'margins': margins})
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return PredictHandler
+
+
+def serve_http(batcher, port, host='127.0.0.1'):
+    """Serves batcher over HTTP on host:port until interrupted."""
+    server = ThreadingHTTPServer((host, port), make_handler(batcher))
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score reviews with a saved sentiment model.')
+    parser.add_argument('model', help='path of the saved SentimentModel')
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--stdio', action='store_true', help='read one review per line on stdin')
+    mode.add_argument('--port', type=int, help='serve HTTP on this localhost port')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--max-latency-ms', type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    model = SentimentModel.load(args.model)
+    batcher = MicroBatcher(model, args.batch_size, args.max_latency_ms / 1000)
+    if args.stdio:
+        serve_stdio(batcher)
+    else:
+        serve_http(batcher, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,10 @@ import sys
 import time
 import traceback
 import project1 as p1
+import sampling
 import numpy as np
 import random
+import scipy.sparse as sparse
 
 verbose = False
 
@@ -107,6 +109,53 @@ def check_get_order():
     log(green("PASS"), ex_name, "")
 
 
+def check_sampler():
+    ex_name = "Sampler"
+
+    if check_array(
+            ex_name, sampling.DEFAULT_SAMPLER.order,
+            np.array(p1.get_order(25)), 25):
+        return
+    if sampling.cached_order(25) is not sampling.cached_order(25):
+        log(red("FAIL"), ex_name, ": the order is not memoized")
+        return
+
+    sampler = sampling.Sampler(per_epoch=True)
+    orders = sampler.orders(25, 3)
+    if not all((np.sort(order) == np.arange(25)).all() for order in orders):
+        log(red("FAIL"), ex_name, ": per-epoch orders are not permutations:", orders)
+        return
+    if (orders[0] == orders[1]).all():
+        log(red("FAIL"), ex_name, ": per-epoch orders are all the same")
+        return
+
+    # Epoch by epoch, as the trainers ask, every permutation is drawn once
+    drawn = []
+    epoch_permutation = sampling.epoch_permutation
+    sampling.epoch_permutation = lambda *args: drawn.append(args) or epoch_permutation(*args)
+    try:
+        sampler = sampling.Sampler(per_epoch=True)
+        epochs = [sampler.order(25, t) for t in range(50)]
+    finally:
+        sampling.epoch_permutation = epoch_permutation
+    if not len(drawn) == 50:
+        log(red("FAIL"), ex_name, ": drew", len(drawn), "permutations for 50 epochs")
+        return
+    if not all((order == orders[t]).all() for t, order in enumerate(epochs[:3])) or \
+            not (sampler.orders(25, 50) == np.array(epochs)).all():
+        log(red("FAIL"), ex_name, ": per-epoch orders depend on the order of the requests")
+        return
+
+    labels = np.array([1] * 20 + [-1] * 5)
+    order = sampling.Sampler(stratified=True).order(25, 0, labels)
+    exp_res = np.array([1, 1, -1, 1, 1] * 5)
+    if not (labels[order] == exp_res).all():
+        log(red("FAIL"), ex_name, ": stratified order is not balanced. Expected", exp_res, ", got: ", labels[order])
+        return
+
+    log(green("PASS"), ex_name, "")
+
+
 def check_hinge_loss_single():
     ex_name = "Hinge loss single"
 
@@ -306,6 +355,327 @@ def check_pegasos():
     log(green("PASS"), ex_name, "")
 
 
+def check_inplace_engine():
+    ex_name = "In-place engine"
+
+    rng = np.random.RandomState(0)
+    feature_matrix = rng.randint(0, 3, size=(200, 30)).astype(float)
+    labels = np.where(rng.rand(200) > 0.5, 1, -1)
+    for name, train in [
+            ("perceptron", lambda **kw: p1.perceptron(feature_matrix, labels, 5, **kw)),
+            ("average perceptron", lambda **kw: p1.average_perceptron(feature_matrix, labels, 5, **kw)),
+            ("pegasos", lambda **kw: p1.pegasos(feature_matrix, labels, 5, 0.01, **kw))]:
+        exp_res = train()
+        if check_tuple(
+                ex_name + " (" + name + ")", train,
+                exp_res, engine='inplace'):
+            return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_sparse_input():
+    ex_name = "Sparse input"
+
+    texts = [
+        "He loves her ",
+        "He really really loves her",
+        "She hates him"]
+    dictionary = {k: i for i, k in enumerate(["he", "loves", "her", "really", "hates"])}
+    dense = p1.extract_bow_feature_vectors(texts, dictionary)
+    res = p1.extract_bow_feature_vectors(texts, dictionary, sparse_output=True)
+    if not sparse.isspmatrix_csr(res):
+        log(red("FAIL"), ex_name, ": does not return a CSR matrix, type: ", type(res))
+        return
+    if not (res.toarray() == dense).all():
+        log(red("FAIL"), ex_name, ": incorrect answer. Expected", dense, ", got: ", res.toarray())
+        return
+
+    rng = np.random.RandomState(0)
+    feature_matrix = rng.randint(0, 3, size=(200, 30)) * (rng.rand(200, 30) > 0.8)
+    labels = np.where(rng.rand(200) > 0.5, 1, -1)
+    csr = sparse.csr_matrix(feature_matrix)
+    for name, train in [
+            ("perceptron", lambda X: p1.perceptron(X, labels, 5)),
+            ("average perceptron", lambda X: p1.average_perceptron(X, labels, 5)),
+            ("pegasos", lambda X: p1.pegasos(X, labels, 5, 0.01))]:
+        exp_theta, exp_theta_0 = train(feature_matrix)
+        theta, theta_0 = train(csr)
+        if not (np.allclose(theta, exp_theta) and np.isclose(theta_0, exp_theta_0)):
+            log(red("FAIL"), ex_name, "(" + name + ") : incorrect answer. Expected",
+                (exp_theta, exp_theta_0), ", got: ", (theta, theta_0))
+            return
+    if not (p1.classify(csr, theta, theta_0) == p1.classify(feature_matrix, theta, theta_0)).all():
+        log(red("FAIL"), ex_name, "(classify) : predictions differ from the dense matrix")
+        return
+    if not np.isclose(p1.hinge_loss_full(csr, labels, theta, theta_0),
+                      p1.hinge_loss_full(feature_matrix, labels, theta, theta_0)):
+        log(red("FAIL"), ex_name, "(hinge loss full) : loss differs from the dense matrix")
+        return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_scaled_pegasos():
+    ex_name = "Scaled Pegasos"
+
+    rng = np.random.RandomState(0)
+    feature_matrix = rng.randint(0, 3, size=(200, 30)) * (rng.rand(200, 30) > 0.8)
+    labels = np.where(rng.rand(200) > 0.5, 1, -1)
+    for L in [0.01, 1, 10]:
+        exp_theta, exp_theta_0 = p1.pegasos(feature_matrix, labels, 5, L)
+        for X in [feature_matrix, sparse.csr_matrix(feature_matrix)]:
+            theta, theta_0 = p1.pegasos(X, labels, 5, L, engine='scaled')
+            if not (np.allclose(theta, exp_theta) and np.isclose(theta_0, exp_theta_0)):
+                log(red("FAIL"), ex_name, ": incorrect answer for L =", L, ". Expected",
+                    (exp_theta, exp_theta_0), ", got: ", (theta, theta_0))
+                return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_lazy_average_perceptron():
+    ex_name = "Lazy average perceptron"
+
+    feature_matrix = np.array([[1, 2], [-1, 0]])
+    labels = np.array([1, 1])
+    T = 2
+    exp_res = (np.array([-0.25, 1.5]), 1.75)
+    if check_tuple(
+            ex_name, p1.average_perceptron,
+            exp_res, feature_matrix, labels, T, engine='lazy'):
+        return
+
+    rng = np.random.RandomState(0)
+    feature_matrix = rng.randint(0, 3, size=(200, 30)) * (rng.rand(200, 30) > 0.8)
+    labels = np.where(rng.rand(200) > 0.5, 1, -1)
+    exp_res = p1.average_perceptron(feature_matrix, labels, 5)
+    for X in [feature_matrix, sparse.csr_matrix(feature_matrix)]:
+        if check_tuple(
+                ex_name, p1.average_perceptron,
+                exp_res, X, labels, 5, engine='lazy'):
+            return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_checkpoints():
+    ex_name = "Epoch checkpoints"
+
+    rng = np.random.RandomState(0)
+    feature_matrix = rng.randint(0, 3, size=(100, 20)).astype(float)
+    labels = np.where(rng.rand(100) > 0.5, 1, -1)
+    Ts = [1, 3, 2]
+    for name, train in [
+            ("perceptron", lambda T, **kw: p1.perceptron(feature_matrix, labels, T, **kw)),
+            ("average perceptron", lambda T, **kw: p1.average_perceptron(feature_matrix, labels, T, **kw)),
+            ("pegasos", lambda T, **kw: p1.pegasos(feature_matrix, labels, T, 0.01, **kw))]:
+        res = train(max(Ts), checkpoints=Ts)
+        if not type(res) == list or not len(res) == len(Ts):
+            log(red("FAIL"), ex_name, "(" + name + ") : expected a list of", len(Ts), "tuples, got: ", res)
+            return
+        for T, snapshot in zip(Ts, res):
+            exp_res = train(T)
+            if not all(equals(x, y) for x, y in zip(snapshot, exp_res)):
+                log(red("FAIL"), ex_name, "(" + name + ") : incorrect answer for T =", T,
+                    ". Expected", exp_res, ", got: ", snapshot)
+                return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_streaming():
+    ex_name = "Streaming trainers"
+
+    rng = np.random.RandomState(0)
+    feature_matrix = rng.randint(0, 3, size=(100, 20)).astype(float)
+    labels = np.where(rng.rand(100) > 0.5, 1, -1)
+    order = np.array(p1.get_order(100))
+
+    def make_chunks():
+        for start in range(0, 100, 30):
+            chunk = order[start:start + 30]
+            yield feature_matrix[chunk], labels[chunk]
+
+    # With a buffer of one sample the stream keeps the order of get_order
+    for name, train, train_stream in [
+            ("perceptron",
+             lambda: p1.perceptron(feature_matrix, labels, 3),
+             lambda: p1.perceptron_stream(make_chunks, 3, buffer_size=1)),
+            ("average perceptron",
+             lambda: p1.average_perceptron(feature_matrix, labels, 3),
+             lambda: p1.average_perceptron_stream(make_chunks, 3, buffer_size=1, prefetch=2)),
+            ("pegasos",
+             lambda: p1.pegasos(feature_matrix, labels, 3, 0.1),
+             lambda: p1.pegasos_stream(make_chunks, 3, 0.1, buffer_size=1))]:
+        if check_tuple(ex_name + " (" + name + ")", train_stream, train()):
+            return
+
+    theta, theta_0 = p1.perceptron_stream(make_chunks, 3, buffer_size=40)
+    if not theta.shape == (20,):
+        log(red("FAIL"), ex_name, ": expected theta of shape (20,), got: ", theta.shape)
+        return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_early_stopping():
+    ex_name = "Early stopping"
+
+    rng = np.random.RandomState(0)
+    feature_matrix = rng.randn(100, 5)
+    labels = np.where(feature_matrix @ np.array([1, -2, 0.5, 0, 1]) > 0, 1, -1)
+    T = 50
+    for engine in ['reference', 'inplace', 'lazy']:
+        history = []
+        res = p1.perceptron(feature_matrix, labels, T, engine=engine,
+                            stop_mistake_rate=0, history=history)
+        if not len(history) < T or not history[-1]['mistakes'] == 0:
+            log(red("FAIL"), ex_name, ": did not stop after an epoch without mistakes:", history)
+            return
+        if not history[-1]['updates'] == sum(epoch['mistakes'] for epoch in history):
+            log(red("FAIL"), ex_name, ": inconsistent update counts:", history)
+            return
+        # Without mistakes theta cannot change any more
+        if check_tuple(
+                ex_name + " (" + engine + ")", p1.perceptron,
+                p1.perceptron(feature_matrix, labels, T),
+                feature_matrix, labels, T, engine=engine, stop_mistake_rate=0):
+            return
+
+    history = []
+    res = p1.average_perceptron(feature_matrix, labels, T, stop_mistake_rate=1, history=history)
+    if not len(history) == 1:
+        log(red("FAIL"), ex_name, ": expected a single epoch, got: ", history)
+        return
+    if not all(equals(x, y) for x, y in zip(p1.average_perceptron(feature_matrix, labels, 1), res)):
+        log(red("FAIL"), ex_name, ": average perceptron does not average over the epochs run")
+        return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_telemetry():
+    ex_name = "Training telemetry"
+
+    rng = np.random.RandomState(0)
+    feature_matrix = rng.randn(100, 5)
+    labels = np.where(feature_matrix @ np.array([1, -2, 0.5, 0, 1]) > 0, 1, -1)
+    T = 3
+    for trainer, args in [(p1.perceptron, ()), (p1.average_perceptron, ()), (p1.pegasos, (0.1,))]:
+        events = []
+        res = trainer(feature_matrix, labels, T, *args, callbacks=[events.append], callback_every=40)
+        if not all(equals(x, y) for x, y in zip(res, trainer(feature_matrix, labels, T, *args))):
+            log(red("FAIL"), ex_name, ":", trainer.__name__, "gives a different result with callbacks")
+            return
+        reported = [(event['event'], event['epoch'], event['samples']) for event in events]
+        expected = [('samples', 1, 40), ('samples', 1, 80), ('epoch', 1, 100),
+                    ('samples', 2, 120), ('samples', 2, 160), ('samples', 2, 200), ('epoch', 2, 200),
+                    ('samples', 3, 240), ('samples', 3, 280), ('epoch', 3, 300)]
+        if not reported == expected:
+            log(red("FAIL"), ex_name, ":", trainer.__name__, "reported", reported, "expected", expected)
+            return
+
+    history = []
+    events = []
+    theta, theta_0 = p1.perceptron(feature_matrix, labels, T, history=history, callbacks=[events.append])
+    if not [event['updates'] for event in events] == [epoch['updates'] for epoch in history]:
+        log(red("FAIL"), ex_name, ": update counts differ from the history")
+        return
+    if not np.isclose(events[-1]['theta_norm'], np.linalg.norm(theta)) or \
+            not np.isclose(events[-1]['hinge_loss'], p1.hinge_loss_full(feature_matrix, labels, theta, theta_0)):
+        log(red("FAIL"), ex_name, ": incorrect norm or hinge loss", events[-1])
+        return
+    events = []
+    theta, theta_0 = p1.pegasos(feature_matrix, labels, T, 0.1, engine='scaled', callbacks=[events.append])
+    if not np.isclose(events[-1]['theta_norm'], np.linalg.norm(theta)):
+        log(red("FAIL"), ex_name, ": incorrect norm of the scaled engine", events[-1])
+        return
+
+    # Pegasos counts the steps violating the margin, like the perceptron mistakes
+    theta, theta_0, step, violations = np.zeros(5), 0, 0, 0
+    for t in range(T):
+        for i in p1.get_order(feature_matrix.shape[0]):
+            step += 1
+            violations += labels[i] * (theta @ feature_matrix[i] + theta_0) <= 1
+            theta, theta_0 = p1.pegasos_single_step_update(
+                feature_matrix[i], labels[i], 0.1, 1 / np.sqrt(step), theta, theta_0)
+    for engine in ['reference', 'inplace', 'scaled']:
+        events = []
+        p1.pegasos(feature_matrix, labels, T, 0.1, engine=engine, callbacks=[events.append])
+        if not events[-1]['updates'] == violations < events[-1]['samples']:
+            log(red("FAIL"), ex_name, ": Pegasos reported", events[-1]['updates'], "updates instead of", violations)
+            return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_multiclass():
+    ex_name = "Multiclass"
+
+    feature_matrix = np.array([[1, 0], [0, 1], [-1, -1], [2, 0], [0, 2], [-2, -2]])
+    labels = np.array([5, 3, 1, 5, 3, 1])
+    T = 5
+    for trainer, args in [(p1.multiclass_perceptron, ()), (p1.multiclass_pegasos, (0.1,))]:
+        theta, theta_0 = trainer(feature_matrix, labels, T, *args)
+        if not theta.shape == (3, 2) or not theta_0.shape == (3,):
+            log(red("FAIL"), ex_name, ": unexpected shapes", theta.shape, theta_0.shape)
+            return
+        preds = p1.classify_multiclass(feature_matrix, theta, theta_0, labels)
+        if not (preds == labels).all():
+            log(red("FAIL"), ex_name, ": training data misclassified:", preds)
+            return
+        res = trainer(sparse.csr_matrix(feature_matrix), labels, T, *args)
+        if not all(np.allclose(x, y) for x, y in zip(res, (theta, theta_0))):
+            log(red("FAIL"), ex_name, ": sparse input gives different weights")
+            return
+
+    # A single mistake moves the true row towards the sample and the best
+    # other row away from it
+    theta, theta_0 = p1.multiclass_perceptron(feature_matrix[:1], labels[:1], 1, classes=[1, 3, 5])
+    if not equals(theta, np.array([[-1, 0], [0, 0], [1, 0]])) or not equals(theta_0, np.array([-1, 0, 1])):
+        log(red("FAIL"), ex_name, ": incorrect single update", theta, theta_0)
+        return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_kernel_perceptron():
+    ex_name = "Kernel perceptron"
+
+    rng = np.random.RandomState(0)
+    feature_matrix = rng.randint(-3, 4, (100, 5)).astype(float)
+    labels = np.where(feature_matrix @ np.array([1, -2, 0.5, 0, 1]) > 0, 1, -1)
+    T = 5
+
+    # With a linear kernel theta is the sum of the support vectors
+    theta, theta_0 = p1.perceptron(feature_matrix, labels, T)
+    linear = {'degree': 1, 'c': 0}
+    for matrix in [feature_matrix, sparse.csr_matrix(feature_matrix)]:
+        alpha, alpha_0 = p1.kernel_perceptron(matrix, labels, T, 'polynomial', linear, cache_bytes=800)
+        if not equals(feature_matrix.T @ (alpha * labels), theta) or not alpha_0 == theta_0:
+            log(red("FAIL"), ex_name, ": linear kernel does not match perceptron")
+            return
+
+    feature_matrix = rng.randn(100, 2)
+    labels = np.where(feature_matrix[:, 0] * feature_matrix[:, 1] > 0, 1, -1)
+    for kernel, params in [('polynomial', {'degree': 2}), ('rbf', {'gamma': 1})]:
+        alpha, alpha_0 = p1.kernel_perceptron(feature_matrix, labels, 20, kernel, params)
+        preds = p1.kernel_classify(feature_matrix, feature_matrix, labels, alpha, alpha_0, kernel, params)
+        if not (preds == labels).mean() > 0.9:
+            log(red("FAIL"), ex_name, ":", kernel, "kernel does not fit the data, accuracy", (preds == labels).mean())
+            return
+
+    gram = p1.GramCache(feature_matrix, p1.kernel_function('rbf'), max_bytes=8 * 100 * 3)
+    for i in [0, 1, 2, 0, 3, 0, 1]:
+        gram[i]
+    if not (gram.hits, gram.misses) == (2, 5) or not len(gram._rows) == 3:
+        log(red("FAIL"), ex_name, ": Gram cache is not least recently used:", gram.hits, gram.misses)
+        return
+
+    log(green("PASS"), ex_name, "")
+
+
 def check_classify():
     ex_name = "Classify"
 
@@ -365,6 +735,55 @@ def check_classifier_accuracy():
 
     log(green("PASS"), ex_name, "")
 
+def check_evaluate():
+    ex_name = "Chunked evaluation"
+
+    rng = np.random.RandomState(0)
+    feature_matrix = rng.randint(0, 3, (103, 6)).astype(float)
+    labels = np.where(rng.rand(103) > 0.5, 1, -1)
+    theta = rng.randint(-2, 3, 6).astype(float)
+    theta_0 = -1
+    preds = p1.classify(feature_matrix, theta, theta_0)
+    confusion = np.array([[np.sum((labels == true) & (preds == pred)) for pred in (-1, 1)]
+                          for true in (-1, 1)])
+    for matrix in [feature_matrix, sparse.csr_matrix(feature_matrix)]:
+        res = p1.evaluate(matrix, labels, theta, theta_0, block_size=10)
+        if not np.isclose(res['hinge_loss'], p1.hinge_loss_full(feature_matrix, labels, theta, theta_0)):
+            log(red("FAIL"), ex_name, ": incorrect hinge loss", res['hinge_loss'])
+            return
+        if not res['accuracy'] == p1.accuracy(preds, labels) or not equals(res['confusion'], confusion):
+            log(red("FAIL"), ex_name, ": incorrect accuracy or confusion matrix", res['confusion'])
+            return
+
+    res = p1.evaluate(np.array([[1], [2], [-3], [0]]), np.array([1, 1, 1, -1]), np.array([1]), 0,
+                      block_size=3, histogram_edges=[-1, 0, 1])
+    if not equals(res['margin_histogram'], np.array([1, 3])):
+        log(red("FAIL"), ex_name, ": incorrect margin histogram", res['margin_histogram'])
+        return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_extract_words():
+    ex_name = "Extract words"
+
+    texts = [
+        "He loves the beach!!! 5/5, would go again.",
+        "It's 10x better\tthan ΟΔΟΣ's (old) one...",
+        ""]
+    exp_res = [
+        ['he', 'loves', 'the', 'beach', '!', '!', '!', '5', '/', '5', ',', 'would', 'go', 'again', '.'],
+        ['it', "'", 's', '1', '0', 'x', 'better', 'than', 'οδος', "'", 's', '(', 'old', ')', 'one', '.', '.', '.'],
+        []]
+    for text, words in zip(texts, exp_res):
+        if check_list(ex_name, p1.extract_words, words, text):
+            return
+    if check_list(ex_name + " batch", p1.extract_words_batch, exp_res, texts):
+        return
+
+    log(green("PASS"), ex_name, "")
+
+
 def check_bag_of_words():
     ex_name = "Bag of words"
 
@@ -439,10 +858,478 @@ def check_extract_bow_feature_vectors():
         log(red("FAIL"), ex_name, ": unexpected feature matrix")
         return
 
+def check_vectorizer():
+    ex_name = "Bag of words vectorizer"
+
+    train_texts = [
+        "He loves her ",
+        "He really really loves her",
+        "The beach is nice"]
+    val_texts = ["She really loves the beach", "nothing"]
+    stopwords = ["the", "is"]
+    dictionary = p1.bag_of_words(train_texts, stopwords)
+    exp_train = p1.extract_bow_feature_vectors(train_texts, dictionary)
+    exp_val = p1.extract_bow_feature_vectors(val_texts, dictionary)
+
+    # n_jobs=2 tokenizes the texts in worker processes
+    for sparse_output, n_jobs in [(False, 1), (True, 1), (False, 2), (True, 2)]:
+        vectorizer = p1.BagOfWordsVectorizer(stopwords, sparse_output=sparse_output, n_jobs=n_jobs)
+        if not vectorizer.fit(train_texts).dictionary == dictionary:
+            log(red("FAIL"), ex_name, ": wrong fitted dictionary with n_jobs =", n_jobs)
+            return
+        train = vectorizer.fit_transform(train_texts)
+        val = vectorizer.transform(val_texts)
+        if sparse_output:
+            # Built in the index dtype scipy keeps, so it is not copied to downcast
+            if not train.indices.dtype == train.indptr.dtype == np.int32:
+                log(red("FAIL"), ex_name, ": int64 indices with n_jobs =", n_jobs)
+                return
+            train, val = train.toarray(), val.toarray()
+        if not vectorizer.dictionary == dictionary:
+            log(red("FAIL"), ex_name, ": wrong dictionary. Expected", dictionary, ", got: ", vectorizer.dictionary)
+            return
+        if not ((train == exp_train).all() and (val == exp_val).all()):
+            log(red("FAIL"), ex_name, ": incorrect feature matrix. Expected", exp_train, exp_val, ", got: ", train, val)
+            return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_ngram_vectorizer():
+    ex_name = "N-gram vectorizer"
+
+    texts = [
+        "He loves her ",
+        "He really really loves her",
+        "She loves him"]
+    vectorizer = p1.NgramVectorizer(ngram_range=(1, 2))
+    res = vectorizer.fit_transform(texts)
+    if not vectorizer.dictionary["really loves"] == 8:
+        log(red("FAIL"), ex_name, ": unexpected dictionary", vectorizer.dictionary)
+        return
+    if not res[1, vectorizer.dictionary["really"]] == 2:
+        log(red("FAIL"), ex_name, ": incorrect counts", res)
+        return
+    if not (vectorizer.transform(texts) == res).all():
+        log(red("FAIL"), ex_name, ": transform differs from fit_transform")
+        return
+
+    vectorizer = p1.NgramVectorizer(ngram_range=(1, 2), min_df=2, max_df=0.9)
+    vectorizer.fit(texts)
+    exp_res = ['he', 'her', 'loves her']
+    if not list(vectorizer.dictionary) == exp_res:
+        log(red("FAIL"), ex_name, ": pruning by document frequency. Expected", exp_res, ", got: ", list(vectorizer.dictionary))
+        return
+
+    vectorizer = p1.NgramVectorizer(ngram_range=(1, 2), max_features=2, ignore_words=["he"])
+    vectorizer.fit(texts)
+    exp_res = ['loves', 'her']
+    if not list(vectorizer.dictionary) == exp_res:
+        log(red("FAIL"), ex_name, ": pruning by max_features. Expected", exp_res, ", got: ", list(vectorizer.dictionary))
+        return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_hashing_vectorizer():
+    ex_name = "Hashing vectorizer"
+
+    texts = [
+        "He loves her ",
+        "He really really loves her"]
+    vectorizer = p1.HashingVectorizer(n_buckets=2 ** 16)
+    res = vectorizer.transform(texts)
+    if not sparse.isspmatrix_csr(res) or not res.shape == (2, 2 ** 16) or not res.indices.dtype == np.int32:
+        log(red("FAIL"), ex_name, ": expected a CSR matrix of shape", (2, 2 ** 16), ", got: ", type(res), res.shape)
+        return
+    exp_res = np.array([[1, 1, 1, 0], [1, 1, 1, 2]])
+    columns = vectorizer.transform(["he", "loves", "her", "really"]).indices
+    if not (res[:, columns].toarray() == exp_res).all():
+        log(red("FAIL"), ex_name, ": incorrect counts. Expected", exp_res, ", got: ", res[:, columns].toarray())
+        return
+
+    if not p1.csr_index_dtype(10, (2, 2 ** 31)) == np.int64:
+        log(red("FAIL"), ex_name, ": int32 indices for 2 ** 31 buckets")
+        return
+
+    signed = p1.HashingVectorizer(n_buckets=2 ** 16, signed=True).transform(texts)
+    if not (abs(signed).toarray() == res.toarray()).all():
+        log(red("FAIL"), ex_name, ": signed counts differ from the unsigned ones")
+        return
+
+    labels = np.array([1, -1])
+    theta, theta_0 = p1.perceptron(res, labels, 2)
+    if not (p1.classify(res, theta, theta_0) == labels).all():
+        log(red("FAIL"), ex_name, ": perceptron does not separate the hashed features")
+        return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_online_vocabulary():
+    ex_name = "Online vocabulary growth"
+
+    vectorizer = p1.BagOfWordsVectorizer(["the"], sparse_output=True)
+    first = vectorizer.partial_fit_transform(["good film", "the bad film"])
+    second = vectorizer.partial_fit_transform(["great film", "bad acting"])
+    exp_dictionary = {"good": 0, "film": 1, "bad": 2, "great": 3, "acting": 4}
+    if not vectorizer.dictionary == exp_dictionary or not first.shape == (2, 3):
+        log(red("FAIL"), ex_name, ": wrong dictionary", vectorizer.dictionary)
+        return
+    if not equals(second.toarray(), np.array([[0, 1, 0, 1, 0], [0, 0, 1, 0, 1]])):
+        log(red("FAIL"), ex_name, ": incorrect feature matrix", second.toarray())
+        return
+
+    weights = p1.GrowableTheta([1, 2])
+    capacity = weights.capacity
+    weights.grow(capacity + 1)
+    if not weights.capacity == 2 * capacity or not equals(weights.theta[:3], np.array([1, 2, 0])):
+        log(red("FAIL"), ex_name, ": GrowableTheta does not double its capacity", weights.capacity)
+        return
+
+    # Continuing from the weights of 2 epochs gives the weights of 4 epochs,
+    # also when the first epochs only saw some of the features
+    rng = np.random.RandomState(0)
+    feature_matrix = rng.randint(0, 3, (50, 6)).astype(float)
+    labels = np.where(feature_matrix @ rng.randn(6) > 0, 1, -1)
+    for engine in ['reference', 'inplace', 'scaled', 'lazy']:
+        res = p1.perceptron(feature_matrix, labels, 2, engine=engine)
+        res = p1.perceptron(feature_matrix, labels, 2, engine=engine, initial=res)
+        if not all(np.allclose(x, y) for x, y in zip(res, p1.perceptron(feature_matrix, labels, 4))):
+            log(red("FAIL"), ex_name, ": training does not continue from the initial weights with", engine)
+            return
+    n = len(labels)
+    for engine in ['reference', 'inplace', 'scaled']:
+        theta, theta_0 = p1.pegasos(feature_matrix, labels, 2, 0.1, engine=engine)
+        res = p1.pegasos(feature_matrix, labels, 2, 0.1, engine=engine, initial=(theta, theta_0, 2 * n))
+        if not all(np.allclose(x, y) for x, y in zip(res, p1.pegasos(feature_matrix, labels, 4, 0.1))):
+            log(red("FAIL"), ex_name, ": Pegasos does not continue its learning rate with", engine)
+            return
+    feature_matrix[:, 4:] = 0
+    theta, theta_0 = p1.perceptron(feature_matrix[:, :4], labels, 2)
+    if check_tuple(
+            ex_name, p1.perceptron, p1.perceptron(feature_matrix, labels, 4),
+            feature_matrix, labels, 2, initial=(theta, theta_0)):
+        return
+
+    # A GrowableTheta is trained in its own buffer, or given the final weights,
+    # and training it further leaves the results of earlier calls unchanged
+    for engine, matrix in [('reference', feature_matrix), ('inplace', feature_matrix),
+                           ('inplace', sparse.csr_matrix(feature_matrix)),
+                           ('scaled', feature_matrix), ('lazy', feature_matrix)]:
+        weights = p1.GrowableTheta(theta)
+        buffer = weights._buffer
+        first = p1.perceptron(matrix, labels, 2, engine=engine, initial=(weights, theta_0))
+        if not weights._buffer is buffer or not equals(weights.theta, first[0]):
+            log(red("FAIL"), ex_name, ": GrowableTheta does not hold the trained weights with", engine)
+            return
+        first_theta = np.copy(first[0])
+        second = p1.perceptron(matrix, labels, 2, engine=engine, initial=(weights, first[1]))
+        if not equals(first[0], first_theta) or not equals(weights.theta, second[0]):
+            log(red("FAIL"), ex_name, ": training the GrowableTheta changed an earlier result with", engine)
+            return
+    weights = p1.GrowableTheta(theta)
+    first = p1.pegasos(feature_matrix, labels, 2, 0.1, engine='inplace', initial=(weights, theta_0))
+    first_theta = np.copy(first[0])
+    p1.pegasos(feature_matrix, labels, 2, 0.1, engine='inplace', initial=(weights, first[1], 2 * n))
+    if not equals(first[0], first_theta):
+        log(red("FAIL"), ex_name, ": training the GrowableTheta changed an earlier Pegasos result")
+        return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_data_columns():
+    ex_name = "Data columns"
+
+    import utils
+
+    data = utils.load_data('reviews_val.tsv')
+    exp_labels = np.array([datum['sentiment'] for datum in data])
+    exp_texts = [datum['text'] for datum in data]
+    labels, texts = utils.load_data_columns('reviews_val.tsv')
+    if not labels.dtype == np.int8 or not equals(labels, exp_labels) or not texts == exp_texts:
+        log(red("FAIL"), ex_name, ": load_data_columns differs from load_data")
+        return
+
+    # Chunk sizes that do and do not divide the number of reviews
+    for chunk_size in [100, 77, len(data) + 1]:
+        chunks = list(utils.iter_data_columns('reviews_val.tsv', chunk_size))
+        exp_sizes = [min(chunk_size, len(data) - start) for start in range(0, len(data), chunk_size)]
+        if not [len(chunk_texts) for _, chunk_texts in chunks] == exp_sizes or \
+                not all(chunk_labels.dtype == np.int8 for chunk_labels, _ in chunks):
+            log(red("FAIL"), ex_name, ": unexpected chunks of size", chunk_size)
+            return
+        if not equals(np.concatenate([chunk_labels for chunk_labels, _ in chunks]), exp_labels) or \
+                not sum([chunk_texts for _, chunk_texts in chunks], []) == exp_texts:
+            log(red("FAIL"), ex_name, ": chunks of size", chunk_size, "differ from load_data")
+            return
+
+    vectorizer = p1.BagOfWordsVectorizer(sparse_output=True).fit(exp_texts[:100])
+    chunks = list(utils.iter_featurized_chunks('reviews_val.tsv', vectorizer, 77))
+    if not equals(sparse.vstack([matrix for matrix, _ in chunks]).toarray(),
+                  vectorizer.transform(exp_texts).toarray()) or \
+            not equals(np.concatenate([chunk_labels for _, chunk_labels in chunks]), exp_labels):
+        log(red("FAIL"), ex_name, ": iter_featurized_chunks differs from transform")
+        return
+
+    # The sentiments of the submit file are empty
+    labels, texts = utils.load_data_columns('reviews_submit.tsv')
+    if not labels.dtype == np.int8 or not (labels == 0).all() or \
+            not texts == [datum['text'] for datum in utils.load_data('reviews_submit.tsv')]:
+        log(red("FAIL"), ex_name, ": the empty sentiments of the submit file are not read as 0")
+        return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_write_predictions():
+    ex_name = "Write predictions"
+
+    import shutil
+    import stat
+    import tempfile
+    import utils
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'submit.tsv')
+        with open(path, 'w', encoding='latin1', newline='') as fp:
+            fp.write('sentiment\ttext\r\n\tgreat caf\xe9\r\n\tbad\r\n\r\n\tok\r\n')
+        os.chmod(path, 0o664)
+        with open(path, 'rb') as fp:
+            original = fp.read()
+
+        # Too few, too many and invalid predictions for the 3 reviews
+        for preds in [np.array([1., 1.]), np.array([1, -1, 1, 1]), np.array([1, 0, 1])]:
+            try:
+                utils.write_predictions(path, preds)
+            except AssertionError:
+                pass
+            else:
+                log(red("FAIL"), ex_name, ": no assertion for the predictions", preds)
+                return
+            with open(path, 'rb') as fp:
+                if not fp.read() == original:
+                    log(red("FAIL"), ex_name, ": invalid predictions modified the file")
+                    return
+
+        # Chunked predictions, as written by streaming classification
+        utils.write_predictions(path, [np.array([-1, 1]), [1]])
+        with open(path, 'rb') as fp:
+            result = fp.read()
+        expected = 'sentiment\ttext\r\n-1\tgreat caf\xe9\r\n1\tbad\r\n1\tok\r\n'.encode('latin1')
+        if not result == expected:
+            log(red("FAIL"), ex_name, ": unexpected file contents", result)
+            return
+        if not stat.S_IMODE(os.stat(path).st_mode) == 0o664:
+            log(red("FAIL"), ex_name, ": the file mode changed to", oct(os.stat(path).st_mode))
+            return
+        if not os.listdir(directory) == ['submit.tsv']:
+            log(red("FAIL"), ex_name, ": temporary files left behind", os.listdir(directory))
+            return
+    finally:
+        shutil.rmtree(directory)
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_benchmark_corpus():
+    ex_name = "Benchmark corpus"
+
+    import benchmark
+
+    # Every distinct synthetic word stays one token, plus the symbols
+    for vocabulary in [100, 1000]:
+        dictionary = p1.bag_of_words(benchmark.synthetic_corpus(300, vocabulary, 60))
+        if not 0.9 * vocabulary <= len(dictionary) <= vocabulary + 6:
+            log(red("FAIL"), ex_name, ": a vocabulary of", vocabulary, "gives", len(dictionary), "words")
+            return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_introspection():
+    ex_name = "Introspection"
+
+    import introspection
+    import utils
+
+    # Integer weights, so that many of them tie
+    rng = np.random.RandomState(0)
+    words = introspection.word_array({"w{:03d}".format(i): i for i in rng.permutation(200)})
+    theta = rng.randint(-5, 6, 200).astype(float)
+    pairs = sorted(zip(theta.tolist(), words.tolist()))
+    for k in [1, 10, 57, 200, 300]:
+        positive, negative = introspection.top_features(theta, words, k)
+        if not positive == [(word, weight) for weight, word in pairs[::-1][:k]] or \
+                not negative == [(word, weight) for weight, word in pairs[:k]]:
+            log(red("FAIL"), ex_name, ": top_features differs from sorting all the weights with k =", k)
+            return
+        if not utils.most_explanatory_word(theta, words, k) == utils.most_explanatory_word(theta, words)[:k]:
+            log(red("FAIL"), ex_name, ": most_explanatory_word differs from sorting all the weights with k =", k)
+            return
+
+    feature_matrix = sparse.random(30, 200, density=0.1, format="csr", random_state=rng,
+                                   data_rvs=lambda size: rng.randint(1, 3, size).astype(float))
+    for k in [1, 3, 50]:
+        explanations = introspection.explain_documents(feature_matrix, theta, words, k)
+        for row, explanation in zip(feature_matrix.toarray(), explanations):
+            columns = np.flatnonzero(row)
+            contributions = sorted((abs(row[j] * theta[j]), words[j], row[j] * theta[j]) for j in columns)
+            expected = [(word, value) for _, word, value in contributions[::-1][:k]]
+            if not explanation == expected:
+                log(red("FAIL"), ex_name, ": explain_documents gives", explanation, "instead of", expected)
+                return
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_feature_cache():
+    ex_name = "Feature cache"
+
+    import shutil
+    import stat
+    import tempfile
+    import feature_cache
+
+    dictionary = {"good": 0, "bad": 1, "film": 2, "\xe9cole": 3, "": 4}
+    dense = np.array([[1., 0., 2., 0., 0.], [0., 1., 0., 3., 0.]])
+    datasets = [(sparse.csr_matrix(dense), np.array([1, -1])), (dense, np.array([-1, 1]))]
+    directory = tempfile.mkdtemp()
+    try:
+        cache = feature_cache.FeatureCache(directory)
+        umask = os.umask(0o027)
+        try:
+            cache.save("entry", dictionary, datasets)
+        finally:
+            os.umask(umask)
+        if not stat.S_IMODE(os.stat(cache.path("entry")).st_mode) == 0o750:
+            log(red("FAIL"), ex_name, ": the entry has mode", oct(os.stat(cache.path("entry")).st_mode))
+            return
+        # Left behind by an interrupted save
+        os.mkdir(os.path.join(directory, feature_cache.TMP_PREFIX + "partial"))
+        if not cache.keys() == ["entry"]:
+            log(red("FAIL"), ex_name, ": unexpected keys", cache.keys())
+            return
+        if cache.load(feature_cache.TMP_PREFIX + "partial") is not None:
+            log(red("FAIL"), ex_name, ": loaded a temporary directory")
+            return
+        loaded_dictionary, loaded = cache.load("entry")
+        if not loaded_dictionary == dictionary or not sparse.issparse(loaded[0][0]) or \
+                not equals(loaded[0][0].toarray(), dense) or not equals(np.asarray(loaded[1][0]), dense) or \
+                not all(equals(np.asarray(y), labels) for (_, y), (_, labels) in zip(loaded, datasets)):
+            log(red("FAIL"), ex_name, ": the entry does not round trip", loaded)
+            return
+    finally:
+        shutil.rmtree(directory)
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_sentiment_model():
+    ex_name = "Sentiment model"
+
+    import shutil
+    import stat
+    import tempfile
+    from sentiment_model import SentimentModel, StringTable
+
+    words = ["zebra", "\xe9cole", "Zoo", "apple", "film"]
+    table, order = StringTable.from_words(words)
+    exp_words = sorted(words, key=lambda word: word.encode())
+    if not list(table) == exp_words or not [words[i] for i in order] == exp_words:
+        log(red("FAIL"), ex_name, ": the table is not in byte order", list(table))
+        return
+    if not all(table[word] == exp_words.index(word) for word in words):
+        log(red("FAIL"), ex_name, ": wrong positions", dict(table))
+        return
+    if not set(table._found) == set(words):
+        log(red("FAIL"), ex_name, ": found words are not remembered", table._found)
+        return
+    for word in ["", "b", "zz", "\xe9", "Zo", 1]:
+        try:
+            table[word]
+        except KeyError:
+            pass
+        else:
+            log(red("FAIL"), ex_name, ": no KeyError for the missing word", repr(word))
+            return
+        if word in table._found:
+            log(red("FAIL"), ex_name, ": a missing word is remembered", repr(word))
+            return
+
+    dictionary = {"good": 0, "bad": 1, "film": 2, "\xe9cole": 3, "acting": 4}
+    model = SentimentModel(np.array([1.1, -2.3, 0.1, 0.7, -0.45]), -0.25, dictionary)
+    texts = ["good film", "bad acting", "\xc9cole good bad", "film", ""]
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "model")
+        umask = os.umask(0o027)
+        try:
+            model.save(path)
+            model.save(path)
+        finally:
+            os.umask(umask)
+        if not stat.S_IMODE(os.stat(path).st_mode) == 0o750:
+            log(red("FAIL"), ex_name, ": the model directory has mode", oct(os.stat(path).st_mode))
+            return
+        loaded = SentimentModel.load(path)
+        labels, margins = loaded.predict(texts)
+        exp_labels, exp_margins = model.predict(texts)
+        if not equals(labels, exp_labels) or not np.allclose(margins, exp_margins, rtol=1e-6, atol=1e-6):
+            log(red("FAIL"), ex_name, ": the loaded model predicts", margins, "instead of", exp_margins)
+            return
+        if not os.listdir(directory) == ["model"]:
+            log(red("FAIL"), ex_name, ": temporary directories left behind", os.listdir(directory))
+            return
+        # Words missing from the dictionary are dropped
+        if not equals(loaded.margins(["good film unknown", "unknown"]), loaded.margins(["good film", ""])):
+            log(red("FAIL"), ex_name, ": unknown words change the margins")
+            return
+    finally:
+        shutil.rmtree(directory)
+
+    log(green("PASS"), ex_name, "")
+
+
+def check_micro_batcher():
+    ex_name = "Micro-batched serving"
+
+    import io
+    import serve
+    from sentiment_model import SentimentModel
+
+    model = SentimentModel(np.array([1., -2., 0.5]), -0.25, {"good": 0, "bad": 1, "film": 2})
+    batcher = serve.MicroBatcher(model, batch_size=100, max_latency=0.05)
+    requests = [["good film", "bad"], ["film"], [1], [], ["bad bad film", "good"]]
+    futures = [batcher.submit(texts) for texts in requests]
+    for texts, future in zip(requests, futures):
+        if texts == [1]:
+            if future.exception(timeout=5) is None:
+                log(red("FAIL"), ex_name, ": an invalid text did not fail its request")
+                return
+            continue
+        labels, margins = future.result(timeout=5)
+        exp_labels, exp_margins = model.predict(texts)
+        if not (labels == exp_labels.tolist() and margins == exp_margins.tolist()):
+            log(red("FAIL"), ex_name, ": wrong results for", texts, ":", labels, margins)
+            return
+
+    out = io.StringIO()
+    serve.serve_stdio(batcher, ["good film\n", "bad\n"], out)
+    if not out.getvalue() == "1\t1.25\n-1\t-2.25\n":
+        log(red("FAIL"), ex_name, ": unexpected stdio output", repr(out.getvalue()))
+        return
+
+    log(green("PASS"), ex_name, "")
+
+
 def main():
     log(green("PASS"), "Import project1")
     try:
         check_get_order()
+        check_sampler()
         check_hinge_loss_single()
         check_hinge_loss_full()
         check_perceptron_single_update()
@@ -450,10 +1337,33 @@ def main():
         check_average_perceptron()
         check_pegasos_single_update()
         check_pegasos()
+        check_inplace_engine()
+        check_sparse_input()
+        check_scaled_pegasos()
+        check_lazy_average_perceptron()
+        check_checkpoints()
+        check_streaming()
+        check_early_stopping()
+        check_telemetry()
+        check_multiclass()
+        check_kernel_perceptron()
         check_classify()
         check_classifier_accuracy()
+        check_evaluate()
+        check_extract_words()
         check_bag_of_words()
         check_extract_bow_feature_vectors()
+        check_vectorizer()
+        check_ngram_vectorizer()
+        check_hashing_vectorizer()
+        check_online_vocabulary()
+        check_data_columns()
+        check_write_predictions()
+        check_introspection()
+        check_benchmark_corpus()
+        check_feature_cache()
+        check_sentiment_model()
+        check_micro_batcher()
     except Exception:
         log_exit(traceback.format_exc())
 
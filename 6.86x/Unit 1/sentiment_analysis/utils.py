@@ -1,7 +1,11 @@
 import csv
+import os
+import shutil
+import tempfile
 import numpy as np
 import matplotlib.pyplot as plt
 
+import introspection
 import project1 as p1
 import sys
 
@@ -58,33 +62,137 @@ def load_data(path_data, extras=False):
 
     return data
 
-def write_predictions(path_submit_data, preds):
+def iter_data_columns(path_data, chunk_size=10000):
+    """
+    Streams a reviews TSV file in blocks of at most chunk_size reviews.
+    Yields tuples (labels, texts) where labels is an np.int8 array of the
+    +1/-1 sentiments (0 when the file leaves the sentiment empty, as the
+    submit file does) and texts is the list of review texts.
+
+    Only one block is held in memory at a time, so featurization can start
+    on the first block while the rest of the file is still being read.
+    """
+    global PYTHON3
+
     if PYTHON3:
-        f_data = open(path_submit_data, encoding="latin1")
+        f_data = open(path_data, encoding="latin1")
     else:
-        f_data = open(path_submit_data)
+        f_data = open(path_data)
 
-    reader = csv.DictReader(f_data, delimiter='\t')
-    data = list(reader)
+    with f_data:
+        reader = csv.reader(f_data, delimiter='\t')
+        fieldnames = next(reader)
+        sentiment_col = fieldnames.index('sentiment')
+        text_col = fieldnames.index('text')
+
+        labels = []
+        texts = []
+        for row in reader:
+            if not row:
+                continue
+            labels.append(int(row[sentiment_col] or 0))
+            texts.append(row[text_col])
+            if len(texts) == chunk_size:
+                yield np.array(labels, dtype=np.int8), texts
+                labels = []
+                texts = []
+        if texts:
+            yield np.array(labels, dtype=np.int8), texts
+
+def load_data_columns(path_data):
+    """
+    Columnar version of load_data. Returns the tuple (labels, texts) where
+    labels is an np.int8 array of the +1/-1 sentiments and texts is the list
+    of review texts.
+    """
+    labels = [np.empty(0, dtype=np.int8)]
+    texts = []
+    for chunk_labels, chunk_texts in iter_data_columns(path_data, chunk_size=None):
+        labels.append(chunk_labels)
+        texts.extend(chunk_texts)
+    return np.concatenate(labels), texts
+
+def iter_featurized_chunks(path_data, vectorizer, chunk_size=10000):
+    """
+    Streams a reviews TSV file as (feature_matrix, labels) chunks of at most
+    chunk_size reviews, featurized with vectorizer.transform. This is the
+    chunk format taken by the streaming trainers of project1, e.g.
+    p1.perceptron_stream(lambda: iter_featurized_chunks(path, vectorizer), T).
+    """
+    for labels, texts in iter_data_columns(path_data, chunk_size):
+        yield vectorizer.transform(texts), labels
 
-    assert len(preds) == len(data), \
-           'Expected {} predictions but {} were given.'.format(len(data), len(preds))
+def iter_predictions(preds):
+    """
+    Yields the predictions of preds one by one, where preds is a numpy
+    array, an iterable of predictions or an iterable of prediction chunks
+    (arrays or lists), e.g. the classify output of every chunk of
+    iter_featurized_chunks.
+    """
+    for pred in preds:
+        if np.ndim(pred):
+            for p in np.asarray(pred).astype(int).tolist():
+                yield p
+        else:
+            yield int(pred)
 
-    for pred, datum in zip(preds.astype(int), data):
-        assert pred == 1 or pred == -1, 'Invalid prediction: {}.'.format(pred)
-        datum['sentiment'] = pred
-    f_data.close()
+def write_predictions(path_submit_data, preds):
+    """
+    Writes preds into the sentiment column of the submit TSV file.
 
-    if PYTHON3:
-        f_out = open(path_submit_data, 'w')
-    else:
-        f_out = open(path_submit_data, 'wb')
+    The rows are streamed from the file in step with the predictions into a
+    temporary file in the same directory, which then replaces the original.
+    Neither the rows nor the predictions are held in memory, and the file is
+    left untouched when the predictions are invalid or their count does not
+    match the number of rows.
 
-    writer = csv.DictWriter(f_out, delimiter='\t', fieldnames=reader.fieldnames)
-    writer.writeheader()
-    for datum in data:
-        writer.writerow(datum)
-    f_out.close()
+    Args:
+        path_submit_data - The submit TSV file to update.
+        preds - The +1/-1 predictions in any form taken by iter_predictions.
+    """
+    global PYTHON3
+
+    directory = os.path.dirname(os.path.abspath(path_submit_data))
+    fd, path_tmp = tempfile.mkstemp(dir=directory, suffix='.tsv')
+    os.close(fd)
+    try:
+        if PYTHON3:
+            f_data = open(path_submit_data, encoding="latin1")
+            f_out = open(path_tmp, 'w', encoding="latin1", newline='')
+        else:
+            f_data = open(path_submit_data)
+            f_out = open(path_tmp, 'wb')
+
+        with f_data, f_out:
+            reader = csv.reader(f_data, delimiter='\t')
+            writer = csv.writer(f_out, delimiter='\t')
+            fieldnames = next(reader)
+            sentiment_col = fieldnames.index('sentiment')
+            writer.writerow(fieldnames)
+
+            preds = iter_predictions(preds)
+            n_rows = 0
+            for row in reader:
+                if not row:
+                    continue
+                pred = next(preds, None)
+                if pred is None:
+                    n_preds = n_rows
+                    n_rows += 1 + sum(1 for row in reader if row)
+                    raise AssertionError('Expected {} predictions but {} were given.'.format(
+                        n_rows, n_preds))
+                assert pred == 1 or pred == -1, 'Invalid prediction: {}.'.format(pred)
+                row[sentiment_col] = pred
+                writer.writerow(row)
+                n_rows += 1
+            n_preds = n_rows + sum(1 for pred in preds)
+            assert n_preds == n_rows, \
+                   'Expected {} predictions but {} were given.'.format(n_rows, n_preds)
+        shutil.copymode(path_submit_data, path_tmp)
+        os.replace(path_tmp, path_submit_data)
+    except BaseException:
+        os.remove(path_tmp)
+        raise
 
 def plot_toy_data(algo_name, features, labels, thetas):
     """
@@ -138,30 +246,51 @@ def tune(train_fn, param_vals, train_feats, train_labels, val_feats, val_labels)
     for i, val in enumerate(param_vals):
         theta, theta_0 = train_fn(train_feats, train_labels, val)
 
-        train_preds = p1.classify(train_feats, theta, theta_0)
-        train_accs[i] = p1.accuracy(train_preds, train_labels)
+        train_accs[i] = p1.evaluate(train_feats, train_labels, theta, theta_0)['accuracy']
+        val_accs[i] = p1.evaluate(val_feats, val_labels, theta, theta_0)['accuracy']
 
-        val_preds = p1.classify(val_feats, theta, theta_0)
-        val_accs[i] = p1.accuracy(val_preds, val_labels)
+    return train_accs, val_accs
+
+def tune_epochs(train_fn, Ts, train_feats, train_labels, val_feats, val_labels):
+    """
+    Same as tune() for the number of epochs T, but trains a single time up to
+    max(Ts) and evaluates the snapshots taken after each T in Ts.
+    train_fn must accept (features, labels, T, checkpoints=Ts).
+    """
+    train_accs = np.ndarray(len(Ts))
+    val_accs = np.ndarray(len(Ts))
+
+    snapshots = train_fn(train_feats, train_labels, max(Ts), checkpoints=Ts)
+    for i, (theta, theta_0) in enumerate(snapshots):
+        train_accs[i] = p1.evaluate(train_feats, train_labels, theta, theta_0)['accuracy']
+        val_accs[i] = p1.evaluate(val_feats, val_labels, theta, theta_0)['accuracy']
 
     return train_accs, val_accs
 
 def tune_perceptron(*args):
-    return tune(p1.perceptron, *args)
+    return tune_epochs(p1.perceptron, *args)
 
 def tune_avg_perceptron(*args):
-    return tune(p1.average_perceptron, *args)
+    return tune_epochs(p1.average_perceptron, *args)
 
 def tune_pegasos_T(best_L, *args):
-    def train_fn(features, labels, T):
-        return p1.pegasos(features, labels, T, best_L)
-    return tune(train_fn, *args)
+    def train_fn(features, labels, T, checkpoints=None):
+        return p1.pegasos(features, labels, T, best_L, checkpoints=checkpoints)
+    return tune_epochs(train_fn, *args)
 
 def tune_pegasos_L(best_T, *args):
     def train_fn(features, labels, L):
         return p1.pegasos(features, labels, best_T, L)
     return tune(train_fn, *args)
 
-def most_explanatory_word(theta, wordlist):
-    """Returns the word associated with the bag-of-words feature having largest weight."""
-    return [word for (theta_i, word) in sorted(zip(theta, wordlist))[::-1]]
+def most_explanatory_word(theta, wordlist, k=None):
+    """
+    Returns the words associated with the bag-of-words features, from the
+    largest weight down, words of equal weight from the largest word down.
+    When k is given only the first k words are returned, selected with
+    introspection.top_features instead of sorting every word.
+    """
+    if k is None:
+        return [word for (theta_i, word) in sorted(zip(theta, wordlist))[::-1]]
+    words = np.asarray(wordlist, dtype=object)
+    return [word for (word, theta_i) in introspection.top_features(theta, words, k)[0]]